@@ -1,16 +1,124 @@
+import functools
+import glob
+import hashlib
+import json
 import secrets
 import os
-
-from flask import Flask, render_template, request, url_for, flash, redirect
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+import click
+from flask import (
+    Flask, Response, render_template, request, url_for, flash, redirect, session, jsonify, make_response, abort, g,
+    before_render_template, template_rendered,
+    )
+from flask.cli import AppGroup
 from flask_login import LoginManager, UserMixin, current_user, login_user, logout_user, login_required
+from markupsafe import Markup
+from sqlalchemy.exc import IntegrityError
 from werkzeug.urls import url_parse
 
-from src.book import BookingManager
+from src.book import DEFAULT_SQLITE_PRAGMAS, Database, RenderCache, BookingManager
+from src.cache import SharedCache
+from src.importer import Importer
+from src.metrics import Metrics
+from src.events import EventHub
+from src.formatting import DEFAULT_TIMEZONE, Formatter
+
+
+def read_secret_key(path: str) -> str:
+    # The key in the file, created on first use, so that every worker and restart signs sessions alike
+    if not os.path.exists(path):
+        key = secrets.token_urlsafe(32)
+        new_path = f'{path}.{os.getpid()}'
+        with open(os.open(new_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as file:
+            file.write(key)
+        try:
+            # Linking fails if another process got there first, its key is then used
+            os.link(new_path, path)
+        except FileExistsError:
+            pass
+        except OSError:
+            # Filesystems without hard links, where only the process creating the file writes its key
+            try:
+                with open(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'w') as file:
+                    file.write(key)
+            except FileExistsError:
+                pass
+        finally:
+            os.remove(new_path)
+    for _ in range(50):
+        with open(path) as file:
+            key = file.read().strip()
+        if key:
+            return key
+        # Created by another process that has not written the key yet
+        time.sleep(0.1)
+    raise RuntimeError(f'no secret key in {path}')
+
+
+def build_token(root: str, timezone: str) -> str:
+    # Digest of the code, templates and display settings pages are rendered with, so that after a deploy
+    # changing any of them clients holding pages of an unchanged booking get them again instead of a 304
+    digest = hashlib.sha256(timezone.encode())
+    paths = [os.path.join(root, 'app.py')] + glob.glob(os.path.join(root, 'src', '*.py'))
+    paths += glob.glob(os.path.join(root, 'templates', '**', '*.html'), recursive=True)
+    for path in sorted(paths):
+        with open(path, 'rb') as file:
+            digest.update(file.read())
+    return digest.hexdigest()[:8]
+
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = secrets.token_urlsafe(16)
-
-b = BookingManager()
+# File holding a secret key shared by all worker processes, used unless SECRET_KEY is set
+app.config['SECRET_KEY_FILE'] = ''
+app.config['DATABASE_URL'] = 'sqlite+pysqlite:///data/tables.db'
+app.config['SQLITE_PRAGMAS'] = dict(DEFAULT_SQLITE_PRAGMAS)
+app.config['DATABASE_POOL_SIZE'] = 5
+app.config['DATABASE_MAX_OVERFLOW'] = 10
+app.config['FRAGMENT_CACHE_SIZE'] = 512
+# Per-request query counts and timings in a Server-Timing header and at /metrics
+app.config['METRICS'] = False
+# Seconds between keepalives of live result streams, each also checks for missed changes
+app.config['EVENTS_KEEPALIVE'] = 15
+# Timezone of the times shown on pages and of occasion times in calendar exports
+app.config['TIMEZONE'] = DEFAULT_TIMEZONE
+# Rendered tables kept per process ('memory') or shared by the workers of a host in a file ('sqlite')
+app.config['CACHE_BACKEND'] = 'memory'
+app.config['SHARED_CACHE_PATH'] = 'data/cache.db'
+# Overrides from the environment, e.g. BOOK_DATABASE_URL or BOOK_SQLITE_PRAGMAS__synchronous=FULL
+app.config.from_prefixed_env('BOOK')
+if app.config['SECRET_KEY_FILE'] and 'BOOK_SECRET_KEY' not in os.environ:
+    app.config['SECRET_KEY'] = read_secret_key(app.config['SECRET_KEY_FILE'])
+
+db = Database(
+    app.config['DATABASE_URL'],
+    app.config['SQLITE_PRAGMAS'],
+    pool_size=app.config['DATABASE_POOL_SIZE'],
+    max_overflow=app.config['DATABASE_MAX_OVERFLOW'],
+    )
+if app.config['CACHE_BACKEND'] == 'sqlite':
+    cache = SharedCache(app.config['SHARED_CACHE_PATH'])
+else:
+    cache = RenderCache()
+fragments = RenderCache(app.config['FRAGMENT_CACHE_SIZE'])
+metrics = Metrics() if app.config['METRICS'] else None
+hub = EventHub()
+formatter = Formatter(app.config['TIMEZONE'])
+etag_token = build_token(app.root_path, app.config['TIMEZONE'])
+
+# The booking version each page fragment depends on
+FRAGMENT_VERSIONS = {
+    'show_header': 'table_version',
+    'show_rows': 'table_version',
+    'answer_table': 'table_version',
+    'comments': 'version',
+    }
+
+book_cli = AppGroup('book', help='Maintenance of the booking database.')
+app.cli.add_command(book_cli)
 
 login = LoginManager(app)
 login.login_view = 'login'
@@ -28,6 +136,100 @@ class User(UserMixin):
 user = User()
 
 
+def manager(booking_id: str = '') -> BookingManager:
+    return BookingManager(booking_id, db, cache, metrics, hub, formatter)
+
+
+if metrics is not None:
+    metrics.instrument_engine(db.engine)
+    before_render_template.connect(lambda sender, **extra: metrics.start_render(), app, weak=False)
+    template_rendered.connect(lambda sender, **extra: metrics.end_render(), app, weak=False)
+
+    @app.before_request
+    def start_timing():
+        g.metrics_token = metrics.start_request()
+
+    @app.after_request
+    def add_server_timing(response):
+        endpoint = request.endpoint or 'unmatched'
+        timings, seconds = metrics.finish_request(g.pop('metrics_token'), endpoint, response.status_code)
+        response.headers['Server-Timing'] = timings.server_timing(seconds)
+        return response
+
+    @app.teardown_request
+    def finish_failed_timing(error):
+        # Requests that raised never reach after_request
+        if 'metrics_token' in g:
+            metrics.finish_request(g.pop('metrics_token'), request.endpoint or 'unmatched', 500)
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        gauges = {}
+        for name, render_cache in [('table', cache), ('fragment', fragments), ('format', formatter)]:
+            info = render_cache.info()
+            gauges[f'book_{name}_cache_hits'] = (f'Hits of the {name} cache.', info['hits'])
+            gauges[f'book_{name}_cache_misses'] = (f'Misses of the {name} cache.', info['misses'])
+            gauges[f'book_{name}_cache_size'] = (f'Entries in the {name} cache.', info['size'])
+        info = hub.info()
+        gauges['book_event_streams'] = ('Open live result streams of this process.', info['subscribers'])
+        gauges['book_event_bookings'] = ('Bookings followed by live result streams of this process.', info['bookings'])
+        return Response(metrics.prometheus(gauges), mimetype='text/plain; version=0.0.4')
+
+
+@app.template_global()
+def fragment(name: str, booking: dict) -> Markup:
+    # A fragment is reused while the booking version it depends on is the one of the table being rendered
+    key = f"{name}:{booking['edit_name']}"
+    version = booking[FRAGMENT_VERSIONS[name]]
+    html = fragments.get(booking['booking_id'], key, version)
+    if html is None:
+        html = Markup(render_template(f'fragments/{name}.html', booking=booking))
+        fragments.put(booking['booking_id'], key, html, version)
+    return html
+
+
+def warmup(n_bookings: int = 50) -> None:
+    # Work done once before worker processes are forked: templates compiled, the front page listed and
+    # the tables of the latest bookings cached. Pooled connections are closed so no worker inherits them.
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    for booking in manager().index_list(n_bookings):
+        manager(booking['booking_id']).to_table()
+    db.engine.dispose()
+
+
+def booking_version(booking_id: str) -> Optional[int]:
+    # Archived bookings are restored when they are asked for
+    version = db.get_version(booking_id)
+    if version is None:
+        # Read the version again even if another request got to restore the booking first
+        db.restore(booking_id)
+        version = db.get_version(booking_id)
+    return version
+
+
+def etagged(view):
+    # Answer GETs with 304 when the client holds the current version of the booking, before any table is read
+    @functools.wraps(view)
+    def decorated_view(booking_id: str, **kwargs):
+        version = booking_version(booking_id)
+        if version is None:
+            abort(404)
+        # Views build their tables for the version the ETag names
+        g.booking_version = version
+        if request.method != 'GET' or '_flashes' in session:
+            return view(booking_id, **kwargs)
+        etag = f'{booking_id}-{version}-{etag_token}'
+        if request.if_none_match.contains(etag):
+            response = make_response('', 304)
+        else:
+            response = make_response(view(booking_id, **kwargs))
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return decorated_view
+
+
 @login.user_loader
 def load_user(user_id):
     return user
@@ -59,7 +261,12 @@ def logout():
 @app.route('/')
 @login_required
 def index():
-    return render_template('index.html', bookings=b.index_list())
+    n = 10
+    page = max(request.args.get('page', 1, type=int), 1)
+    before = request.args.get('before', '')
+    # One booking beyond the page tells whether there are older ones
+    bookings = manager().index_list(n + 1, (page - 1) * n, before)
+    return render_template('index.html', bookings=bookings[:n], older=len(bookings) > n, page=page, before=before)
 
 
 @app.route('/create/', defaults={'booking_id': ''}, methods=('GET', 'POST'))
@@ -67,7 +274,9 @@ def index():
 @login_required
 def create(booking_id: str):
     edit = booking_id != ''
-    b.set_context(booking_id)
+    if edit and booking_version(booking_id) is None:
+        abort(404)
+    b = manager(booking_id)
     if request.method == 'POST':
         title = request.form['title']
         location = request.form.get('location', '')
@@ -97,19 +306,21 @@ def create(booking_id: str):
 
 @app.route('/show/<booking_id>')
 @login_required
+@etagged
 def show(booking_id: str):
-    b.set_context(booking_id)
-    return render_template('show.html', booking=b.to_table(), booking_id=booking_id)
+    b = manager(booking_id)
+    return render_template('show.html', booking=b.to_table(version=g.booking_version), booking_id=booking_id)
 
 
 @app.route('/answer/<booking_id>', defaults={'edit_name': ''}, methods=['GET', 'POST'])
 @app.route('/answer/<booking_id>/<edit_name>', methods=['GET', 'POST'])
 @login_required
+@etagged
 def answer(booking_id: str, edit_name: str):
     edit = edit_name != ''
-    b.set_context(booking_id)
+    b = manager(booking_id)
 
-    booking = b.to_table(edit_name)
+    booking = b.to_table(edit_name, g.booking_version)
     booking['tristates'] = ['\u274C', '\u2705', '\u2753']
     booking['tristate_answers'] = [booking['tristates'][x] for x in booking['edit_answers']]
 
@@ -129,21 +340,27 @@ def answer(booking_id: str, edit_name: str):
         elif name in b.names_list() and not edit:
             flash('Namnet är redan registrerat.')
         else:
-            if not edit:
-                b.add_answers(occasions, name, answers)
+            try:
+                if not edit:
+                    b.add_answers(occasions, name, answers)
+                else:
+                    b.update_answers(occasions, name, answers)
+            except IntegrityError:
+                # Another submission of the same name got in between the check and the insert
+                flash('Namnet är redan registrerat.')
             else:
-                b.update_answers(occasions, name, answers)
-            if comment != '':
-                b.add_comment(name, comment)
-            return redirect(url_for('show', booking_id=booking_id))
+                if comment != '':
+                    b.add_comment(name, comment)
+                return redirect(url_for('show', booking_id=booking_id))
 
     return render_template('answer.html', booking=booking, edit=edit)
 
 
 @app.route('/comment/<booking_id>', methods=['GET', 'POST'])
 @login_required
+@etagged
 def comment(booking_id: str):
-    b.set_context(booking_id)
+    b = manager(booking_id)
 
     if request.method == 'POST':
         name = request.form['name']
@@ -157,4 +374,184 @@ def comment(booking_id: str):
             b.add_comment(name, comment)
             return redirect(url_for('show', booking_id=booking_id))
 
-    return render_template('comment.html', booking=b.to_table())
+    return render_template('comment.html', booking=b.to_table(version=g.booking_version))
+
+
+@app.route('/events/<booking_id>')
+@login_required
+def events(booking_id: str):
+    # Server-sent events with the changes to a booking, the version after each change is its event id
+    version = booking_version(booking_id)
+    if version is None:
+        abort(404)
+    last_id = request.headers.get('Last-Event-ID', request.args.get('version', ''))
+    keepalive = app.config['EVENTS_KEEPALIVE']
+
+    def stream(seen: int):
+        subscription = hub.subscribe(booking_id)
+        try:
+            yield f'retry: {keepalive * 1000}\n\n'
+            current = db.get_version(booking_id) or seen
+            while True:
+                if seen < current or subscription.overflowed:
+                    # Changes were missed while disconnected, by falling behind or on another worker
+                    if subscription.overflowed:
+                        subscription.clear()
+                        current = db.get_version(booking_id) or current
+                    seen = current
+                    yield f'id: {current}\nevent: stale\ndata: {{}}\n\n'
+                event = subscription.get(keepalive)
+                if event is None:
+                    current = db.get_version(booking_id) or current
+                    yield ': keepalive\n\n'
+                    continue
+                yield f"id: {event['version']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+                # A skipped version is a change this stream did not carry
+                if event['version'] == seen + 1:
+                    seen = event['version']
+                current = max(current, event['version'])
+        finally:
+            hub.unsubscribe(subscription)
+
+    seen = int(last_id) if last_id.isdigit() else version
+    return Response(stream(seen), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+@app.route('/api/bookings/<booking_id>')
+@login_required
+@etagged
+def api_booking(booking_id: str):
+    return jsonify(manager(booking_id).details())
+
+
+@app.route('/api/bookings/<booking_id>/occasions')
+@login_required
+@etagged
+def api_occasions(booking_id: str):
+    return jsonify(manager(booking_id).occasions_summary())
+
+
+@app.route('/api/bookings/<booking_id>/answers')
+@login_required
+@etagged
+def api_answers(booking_id: str):
+    return jsonify(manager(booking_id).answers_matrix())
+
+
+@app.route('/api/bookings/<booking_id>/comments')
+@login_required
+@etagged
+def api_comments(booking_id: str):
+    return jsonify(manager(booking_id).comments_list())
+
+
+@app.route('/export/<booking_id>.csv')
+@login_required
+@etagged
+def export_csv(booking_id: str):
+    # Streamed straight from the database, so the size of a poll does not matter
+    return Response(
+        manager(booking_id).export_csv(), mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename={booking_id}.csv'},
+        )
+
+
+@app.route('/export/<booking_id>.ics')
+@login_required
+@etagged
+def export_ics(booking_id: str):
+    top = max(request.args.get('top', 1, type=int), 1)
+    return Response(
+        manager(booking_id).export_ics(top), mimetype='text/calendar',
+        headers={'Content-Disposition': f'attachment; filename={booking_id}.ics'},
+        )
+
+
+@book_cli.command('export', help='Write the answers of all active bookings as CSV to OUTPUT, by default stdout.')
+@click.argument('output', type=click.File('w', encoding='utf-8'), default='-')
+def export(output) -> None:
+    for chunk in manager().export_csv():
+        output.write(chunk)
+
+
+@book_cli.command('import', help='Load polls from JSONL or CSV files, one transaction per batch of rows.')
+@click.argument('files', type=click.File('r', encoding='utf-8'), nargs=-1, required=True)
+@click.option('--format', 'file_format', type=click.Choice(['jsonl', 'csv']), help='Default from the file extension.')
+@click.option('--batch-size', default=20000, show_default=True, help='Rows per transaction.')
+def import_polls(files, file_format: str, batch_size: int) -> None:
+    importer = Importer(db, batch_size)
+
+    def progress(stats: dict) -> None:
+        rate = stats['rows'] / stats['seconds'] if stats['seconds'] else 0
+        click.echo(f"{stats['bookings']} bookings, {stats['rows']} rows, {rate:.0f} rows/s", err=True)
+
+    for file in files:
+        if (file_format or os.path.splitext(file.name)[1].lstrip('.')) == 'csv':
+            polls = importer.read_csv(file, title=os.path.splitext(os.path.basename(file.name))[0])
+        else:
+            polls = importer.read_jsonl(file)
+        stats = importer.load(polls, progress)
+        for booking_id, reason in stats['skipped']:
+            click.echo(f'{file.name}: skipped {booking_id}: {reason}', err=True)
+        click.echo(
+            f"{file.name}: imported {stats['bookings']} bookings, {stats['rows']} rows, "
+            f"skipped {len(stats['skipped'])} in {stats['seconds']:.1f} s"
+            )
+
+
+@book_cli.command('archive', help='Move hidden or old bookings with all their rows into the compressed archive.')
+@click.option('--inactive/--no-inactive', default=True, show_default=True, help='Archive hidden bookings.')
+@click.option('--older-than', type=int, help='Also archive bookings created more than this many days ago.')
+@click.option('--batch-size', default=500, show_default=True, help='Bookings per transaction.')
+@click.option('--compact', is_flag=True, help='Compact the database afterwards.')
+def archive(inactive: bool, older_than: Optional[int], batch_size: int, compact: bool) -> None:
+    created_before = ''
+    if older_than is not None:
+        created_before = (datetime.utcnow() - timedelta(days=older_than)).replace(microsecond=0).isoformat()
+    total = 0
+    while True:
+        booking_ids = db.archive_candidates(inactive, created_before, batch_size)
+        if not booking_ids:
+            break
+        total += db.archive(booking_ids)
+        for booking_id in booking_ids:
+            cache.invalidate(booking_id)
+        click.echo(f'{total} bookings archived', err=True)
+    click.echo(f'Archived {total} bookings.')
+    if compact:
+        compact_database()
+
+
+@book_cli.command('restore', help='Move archived bookings back, they are also restored when they are opened.')
+@click.argument('booking_ids', nargs=-1, required=True)
+def restore(booking_ids) -> None:
+    for booking_id in booking_ids:
+        click.echo(f"{booking_id}: {'restored' if db.restore(booking_id) else 'not archived'}")
+
+
+@book_cli.command('compact', help='Reclaim the space of deleted rows and refresh statistics, e.g. nightly from cron.')
+def compact() -> None:
+    compact_database()
+
+
+def compact_database() -> None:
+    size = db.size()
+    db.compact()
+    if size is not None:
+        click.echo(f'Compacted the database from {size / 2 ** 20:.1f} MB to {db.size() / 2 ** 20:.1f} MB.')
+    else:
+        click.echo('Compacted the database.')
+
+
+@book_cli.command('check-tallies')
+@click.option('--repair', is_flag=True, help='Rebuild the tallies of bookings that have drifted.')
+def check_tallies(repair: bool) -> None:
+    drift = db.check_tallies()
+    for x in drift:
+        click.echo(f"{x['booking_id']} occasion {x['occasion']}: stored {x['stored']}, counted {x['counted']}")
+    click.echo(f'{len(drift)} drifted tallies.')
+    if repair:
+        for booking_id in sorted({x['booking_id'] for x in drift}):
+            db.rebuild_tallies(booking_id)
+            cache.invalidate(booking_id)
+        click.echo('Repaired.')
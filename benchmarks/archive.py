@@ -0,0 +1,60 @@
+"""Size of the database and scan times before and after archiving hidden bookings.
+
+Most synthetic polls are hidden, as in a long running installation. They are archived
+and the database compacted, then the file size, full scans and the front page are
+compared, along with the time to restore one archived booking. Run from the repository
+root:
+
+    python -m benchmarks.archive
+"""
+import os
+import random
+import tempfile
+import time
+
+from src.book import Database, BookingManager
+from benchmarks.common import measure, synthetic_polls
+
+N_POLLS = 2000
+HIDDEN = 0.8
+
+
+def timings(db: Database) -> dict:
+    return {
+        'size (MB)': db.size() / 2 ** 20,
+        'get_bookings (ms)': measure(db.get_bookings) * 1000,
+        'get_answers (ms)': measure(db.get_answers, repeat=1) * 1000,
+        'index_list (ms)': measure(lambda: BookingManager(db=db).index_list(10, 100)) * 1000,
+        }
+
+
+def main():
+    db = Database(f'sqlite+pysqlite:///{os.path.join(tempfile.mkdtemp(), "tables.db")}')
+    booking_ids = synthetic_polls(db, N_POLLS, 20, 20)
+    rng = random.Random(0)
+    hidden = rng.sample(booking_ids, int(N_POLLS * HIDDEN))
+    for booking_id in hidden:
+        db.update_active({'is_active': False}, {'booking_id': booking_id})
+    db.compact()
+    before = timings(db)
+
+    start = time.perf_counter()
+    while True:
+        batch = db.archive_candidates()
+        if not batch:
+            break
+        db.archive(batch)
+    archive_seconds = time.perf_counter() - start
+    db.compact()
+    after = timings(db)
+
+    print(f'{N_POLLS} polls, {len(hidden)} hidden and archived in {archive_seconds:.1f} s')
+    print(f"{'':>18} {'before':>8} {'after':>8}")
+    for key in before:
+        print(f'{key:>18} {before[key]:>8.2f} {after[key]:>8.2f}')
+    restore = measure(lambda: db.restore(hidden.pop()))
+    print(f"{'restore one (ms)':>18} {restore * 1000:>17.2f}")
+
+
+if __name__ == '__main__':
+    main()
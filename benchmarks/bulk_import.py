@@ -0,0 +1,72 @@
+"""Throughput of the bulk importer against replaying polls through the booking manager.
+
+Replaying is what the /create and /answer forms do, one transaction per occasion and per
+name. Both load the same synthetic polls into a scratch SQLite database. Run from the
+repository root:
+
+    python -m benchmarks.bulk_import
+"""
+import json
+import os
+import tempfile
+import time
+
+from src.book import Database, BookingManager
+from src.importer import Importer
+
+N_OCCASIONS = 20
+N_NAMES = 50
+SIZES = [10, 100, 500]
+
+
+def synthetic_polls(n_polls: int) -> list:
+    return [
+        json.dumps({
+            'title': f'Poll {i}',
+            'occasions': [{'date': f'2023-06-{1 + o:02d}', 'time_start': '18:00', 'time_end': '20:00'}
+                          for o in range(N_OCCASIONS)],
+            'answers': {f'name{n}': [(n + o) % 3 for o in range(N_OCCASIONS)] for n in range(N_NAMES)},
+            'comments': [{'name': 'name0', 'comment': 'Comment'}],
+            })
+        for i in range(n_polls)
+        ]
+
+
+def scratch_database() -> Database:
+    return Database(f'sqlite+pysqlite:///{os.path.join(tempfile.mkdtemp(), "tables.db")}')
+
+
+def replay(db: Database, lines: list) -> None:
+    for line in lines:
+        poll = json.loads(line)
+        b = BookingManager(db=db)
+        b.new_context()
+        b.update_bookings(poll['title'], '', '')
+        for occasion in poll['occasions']:
+            b.add_occasion(occasion['date'], occasion['time_start'], occasion['time_end'])
+        occasions = b.occasions_list()
+        for name, answers in poll['answers'].items():
+            b.add_answers(occasions, name, answers)
+        for comment in poll['comments']:
+            b.add_comment(comment['name'], comment['comment'])
+
+
+def main():
+    rows_per_poll = 1 + N_OCCASIONS + N_OCCASIONS * N_NAMES + 1
+    print(f"{'polls':>6} {'rows':>8} {'import (rows/s)':>16} {'replay (rows/s)':>16}")
+    for n_polls in SIZES:
+        lines = synthetic_polls(n_polls)
+        importer = Importer(scratch_database())
+        stats = importer.load(importer.read_jsonl(lines))
+        assert stats['rows'] == n_polls * rows_per_poll and not stats['skipped']
+        imported = stats['rows'] / stats['seconds']
+        # Replaying is slow, so only a sample of the polls is replayed
+        sample = lines[:10]
+        start = time.perf_counter()
+        replay(scratch_database(), sample)
+        replayed = len(sample) * rows_per_poll / (time.perf_counter() - start)
+        print(f'{n_polls:>6} {stats["rows"]:>8} {imported:>16.0f} {replayed:>16.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+import json
+import random
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, List
+
+from src.importer import Importer
+from src.models import OccasionRow, AnswerRow
+
+
+def measure(function: Callable, repeat: int = 5) -> float:
+    # Best wall-clock time in seconds over a number of repeats
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def synthetic_rows(n_occasions: int, n_names: int, seed: int = 0) -> List[list]:
+    # Occasions and answers of one poll where every name has answered every occasion
+    rng = random.Random(seed)
+    occasions = [
+        OccasionRow('bench', i, f'2023-{1 + i // 28:02d}-{1 + i % 28:02d}', '18:00', '20:00')
+        for i in range(n_occasions)
+        ]
+    answers = [
+        AnswerRow('bench', o, f'name{n}', rng.randint(0, 2))
+        for n in range(n_names) for o in range(n_occasions)
+        ]
+    return [occasions, answers]
+
+
+def synthetic_polls(
+        db, n_polls: int, n_occasions: int, n_names: int, n_comments: int = 2, seed: int = 0
+        ) -> List[str]:
+    # Polls of the given size loaded into a scratch database in bulk, oldest first, returns their booking ids
+    rng = random.Random(seed)
+    start = datetime(2023, 1, 1)
+    polls = [
+        {
+            'booking_id': str(uuid.UUID(int=rng.getrandbits(128))),
+            'title': f'Poll {i}',
+            'description': 'Description',
+            'location': 'Location',
+            'time_created': (start + timedelta(minutes=i)).isoformat(),
+            'occasions': [
+                (f'2023-{1 + o // 28:02d}-{1 + o % 28:02d}', '18:00', '20:00') for o in range(n_occasions)
+                ],
+            'answers': [(o, f'name{n}', rng.randint(0, 2)) for n in range(n_names) for o in range(n_occasions)],
+            'comments': [('', f'name{c}', f'Comment {c}') for c in range(n_comments)],
+            }
+        for i in range(n_polls)
+        ]
+    stats = Importer(db).load(polls)
+    if stats['skipped']:
+        raise RuntimeError(f"synthetic polls were skipped: {stats['skipped'][:3]}")
+    return [x['booking_id'] for x in polls]
+
+
+def percentiles(seconds: List[float]) -> dict:
+    # Latency summary in milliseconds of a list of timings in seconds
+    ordered = sorted(seconds)
+
+    def rank(p: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 3)
+
+    return {
+        'count': len(ordered),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3),
+        'p50_ms': rank(0.50),
+        'p95_ms': rank(0.95),
+        'p99_ms': rank(0.99),
+        'max_ms': round(ordered[-1] * 1000, 3),
+        }
+
+
+def write_report(report: dict, output: str = '-') -> None:
+    # JSON report to a file, or to standard output with '-'
+    text = json.dumps(report, indent=2)
+    if output == '-':
+        print(text)
+    else:
+        with open(output, 'w') as file:
+            file.write(text + '\n')
+
+
+def free_port() -> int:
+    with socket.socket() as listener:
+        listener.bind(('127.0.0.1', 0))
+        return listener.getsockname()[1]
+
+
+def wait_for(port: int, timeout: float = 60.0) -> None:
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise
+            time.sleep(0.1)
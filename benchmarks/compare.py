@@ -0,0 +1,44 @@
+"""Compare two JSON reports of benchmarks.micro or benchmarks.load.
+
+Prints the change of p50, p95 and p99 for every result in both reports and exits with
+status 1 when any p95 grew by more than the threshold, so a CI job can catch regressions
+in the hot paths. Run from the repository root:
+
+    python -m benchmarks.compare BASELINE.json CURRENT.json [--threshold 0.2]
+"""
+import argparse
+import json
+import sys
+
+METRICS = ['p50_ms', 'p95_ms', 'p99_ms']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Allowed relative growth of p95')
+    args = parser.parse_args()
+    with open(args.baseline) as file:
+        baseline = json.load(file)['results']
+    with open(args.current) as file:
+        current = json.load(file)['results']
+
+    regressions = []
+    print(f"{'result':<20}" + ''.join(f'{x:>22}' for x in METRICS))
+    for name in [x for x in baseline if x in current]:
+        cells = []
+        for metric in METRICS:
+            before, after = baseline[name][metric], current[name][metric]
+            change = (after - before) / before if before else 0.0
+            cells.append(f'{before:>8.2f} -> {after:>7.2f} {change:>+4.0%}')
+            if metric == 'p95_ms' and change > args.threshold:
+                regressions.append(name)
+        print(f'{name:<20}' + ''.join(f'{x:>22}' for x in cells))
+    if regressions:
+        print(f"p95 regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
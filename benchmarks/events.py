@@ -0,0 +1,162 @@
+"""Fan-out latency of live result events to many open streams, reported as JSON.
+
+The app is served as in production, by one gevent worker of gunicorn started with
+gunicorn.conf.py, since events are broadcast within a process, or with --server werkzeug by
+the threaded development server. One poll is followed by hundreds of server-sent event
+streams sharing a login. Answers are then posted to the poll at a steady
+pace and the time from posting to each stream receiving the event is recorded. The report
+holds p50/p95/p99 delivery latency, the events each stream missed and the latency of the
+posts themselves, and can be compared between runs with benchmarks.compare. Run from the
+repository root:
+
+    python -m benchmarks.events [--server gunicorn] [--streams 300] [--answers 50] [--output events.json]
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+from benchmarks.common import synthetic_polls, percentiles, write_report, free_port, wait_for
+
+
+def login(port: int) -> str:
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    body = urllib.parse.urlencode({'password': os.environ['PASSWORD']})
+    connection.request('POST', '/login', body, {'Content-Type': 'application/x-www-form-urlencoded'})
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+    return response.getheader('Set-Cookie').split(';')[0]
+
+
+def follow(port: int, path: str, cookie: str, ready: threading.Barrier, received: dict, n_events: int) -> None:
+    # Read one stream until n_events answers arrived, recording the arrival time of each by name
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    connection.request('GET', path, headers={'Cookie': cookie, 'Accept': 'text/event-stream'})
+    response = connection.getresponse()
+    response.readline()
+    response.readline()
+    ready.wait()
+    while len(received) < n_events:
+        line = response.readline()
+        if not line:
+            break
+        if line.startswith(b'data: '):
+            event = json.loads(line[6:])
+            if event['type'] == 'answers':
+                received[event['name']] = time.perf_counter()
+    connection.close()
+
+
+def post_answers(port: int, booking_id: str, version: int, args: argparse.Namespace) -> tuple:
+    # Post answers at a steady pace while the streams follow the poll, returns the times they were sent and received
+    cookie = login(port)
+    ready = threading.Barrier(args.streams + 1)
+    received = [{} for _ in range(args.streams)]
+    streams = [
+        threading.Thread(
+            target=follow,
+            args=(port, f'/events/{booking_id}?version={version}', cookie, ready, received[i], args.answers),
+            daemon=True,
+            )
+        for i in range(args.streams)
+        ]
+    for stream in streams:
+        stream.start()
+    ready.wait()
+
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    headers = {'Cookie': cookie, 'Content-Type': 'application/x-www-form-urlencoded'}
+    sent = {}
+    posts = []
+    for i in range(args.answers):
+        name = f'live{i}'
+        body = urllib.parse.urlencode(
+            {'name': name, 'comment': '', 'tristate_answers': ['✅'] * args.occasions}, doseq=True
+            )
+        sent[name] = time.perf_counter()
+        connection.request('POST', f'/answer/{booking_id}', body, headers)
+        connection.getresponse().read()
+        posts.append(time.perf_counter() - sent[name])
+        time.sleep(args.interval)
+    for stream in streams:
+        stream.join(timeout=10)
+    return sent, posts, received
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--server', choices=['gunicorn', 'werkzeug'], default='gunicorn')
+    parser.add_argument('--streams', type=int, default=300, help='Open event streams on one poll')
+    parser.add_argument('--answers', type=int, default=50, help='Answers posted while the streams are open')
+    parser.add_argument('--interval', type=float, default=0.05, help='Seconds between answers')
+    parser.add_argument('--occasions', type=int, default=20)
+    parser.add_argument('--names', type=int, default=30)
+    parser.add_argument('--output', default='-', help='Report file, standard output by default')
+    args = parser.parse_args()
+    if args.server == 'gunicorn' and shutil.which('gunicorn') is None:
+        sys.exit('gunicorn is not installed')
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    directory = tempfile.mkdtemp()
+    os.environ.setdefault('PASSWORD', 'bench')
+    os.environ.setdefault('BOOK_DATABASE_URL', f'sqlite+pysqlite:///{os.path.join(directory, "tables.db")}')
+    from src.book import Database
+    db = Database(os.environ['BOOK_DATABASE_URL'])
+    [booking_id] = synthetic_polls(db, 1, args.occasions, args.names)
+
+    if args.server == 'gunicorn':
+        port = free_port()
+        env = {
+            **os.environ,
+            'BOOK_WORKERS': '1',
+            'BOOK_BIND': f'127.0.0.1:{port}',
+            'BOOK_SECRET_KEY_FILE': os.path.join(directory, 'secret_key'),
+            }
+        server = subprocess.Popen(
+            ['gunicorn', '-c', 'gunicorn.conf.py', '--log-level', 'warning', 'app:app'], cwd=root, env=env
+            )
+    else:
+        sys.path.insert(0, root)
+        from app import app
+        from werkzeug.serving import make_server
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        server.request_queue_size = args.streams
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        port = server.server_port
+    try:
+        wait_for(port)
+        sent, posts, received = post_answers(port, booking_id, db.get_version(booking_id), args)
+    finally:
+        if args.server == 'gunicorn':
+            server.terminate()
+            server.wait()
+        else:
+            server.shutdown()
+
+    delivery = [at - sent[name] for stream in received for name, at in stream.items()]
+    missed = args.streams * args.answers - len(delivery)
+    write_report({
+        'benchmark': 'events',
+        'config': {**vars(args), 'python': platform.python_version()},
+        'results': {
+            'delivery': percentiles(delivery),
+            'answer': percentiles(posts),
+            },
+        'missed': missed,
+        }, args.output)
+    sys.exit(1 if missed else 0)
+
+
+if __name__ == '__main__':
+    main()
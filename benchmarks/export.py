@@ -0,0 +1,53 @@
+"""Memory and time of the CSV export against building the table, for polls with thousands of names.
+
+The export streams rows from a database cursor, so its peak memory should stay flat as the
+number of respondents grows, while to_table holds the whole poll. Peak memory is traced
+allocations while the output is consumed. Run from the repository root:
+
+    python -m benchmarks.export
+"""
+import os
+import tempfile
+import time
+import tracemalloc
+
+from src.book import Database, BookingManager
+from benchmarks.common import synthetic_polls
+
+N_OCCASIONS = 30
+SIZES = [500, 2000, 8000]
+
+
+def traced(function) -> tuple:
+    # Seconds and peak traced memory in MB of one call
+    tracemalloc.start()
+    start = time.perf_counter()
+    function()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak / 2 ** 20
+
+
+def consume(chunks) -> int:
+    return sum(len(x) for x in chunks)
+
+
+def main():
+    db = Database(f'sqlite+pysqlite:///{os.path.join(tempfile.mkdtemp(), "tables.db")}')
+    print(
+        f"{'names':>6} {'answers':>8} {'export (s)':>11} {'export peak (MB)':>17}"
+        f" {'table (s)':>10} {'table peak (MB)':>16}"
+        )
+    for n_names in SIZES:
+        [booking_id] = synthetic_polls(db, 1, N_OCCASIONS, n_names, seed=n_names)
+        export_seconds, export_peak = traced(lambda: consume(BookingManager(booking_id, db).export_csv()))
+        table_seconds, table_peak = traced(lambda: BookingManager(booking_id, db).build_table())
+        print(
+            f'{n_names:>6} {n_names * N_OCCASIONS:>8} {export_seconds:>11.2f} {export_peak:>17.1f}'
+            f' {table_seconds:>10.2f} {table_peak:>16.1f}'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""Time and weekday formatting, converting every value on its own against the cached formatter.
+
+The per-value conversion is the one the pages used before the formatter, looking up the
+zones and parsing on every call. The formatter is timed with an empty cache, converting
+each distinct minute of a column once, and warm, as when the same index page and comments
+are shown again. Run from the repository root:
+
+    python -m benchmarks.formatting
+"""
+import random
+from datetime import datetime, timedelta
+from dateutil import tz
+
+from src.formatting import Formatter, WEEKDAYS
+from benchmarks.common import measure
+
+N_VALUES = 2000
+
+
+def local_time(time: str) -> str:
+    utc = datetime.strptime(time, '%Y-%m-%dT%H:%M:%S').replace(tzinfo=tz.gettz('UTC'))
+    return utc.astimezone(tz.gettz('Europe/Stockholm')).replace(microsecond=0).strftime('%Y-%m-%d %H:%M')
+
+
+def weekday(date: str) -> str:
+    return list(WEEKDAYS)[datetime.strptime(date, '%Y-%m-%d').weekday()] if date != '' else ''
+
+
+def main():
+    rng = random.Random(0)
+    start = datetime(2023, 1, 1)
+    times = [(start + timedelta(seconds=rng.randrange(365 * 86400))).isoformat() for _ in range(N_VALUES)]
+    dates = [(start + timedelta(days=rng.randrange(365))).date().isoformat() for _ in range(N_VALUES)]
+    warm = Formatter()
+    warm.local_times(times)
+    warm.weekdays(dates)
+
+    rows = [
+        ('timestamps', lambda: [local_time(x) for x in times], lambda: Formatter().local_times(times),
+         lambda: warm.local_times(times)),
+        ('weekdays', lambda: [weekday(x) for x in dates], lambda: Formatter().weekdays(dates),
+         lambda: warm.weekdays(dates)),
+        ]
+    print(f'{N_VALUES} values')
+    print(f"{'':>12} {'per value (ms)':>15} {'cold (ms)':>10} {'warm (ms)':>10}")
+    for name, *functions in rows:
+        print(f'{name:>12} ' + ' '.join(f'{measure(x) * 1000:>{w}.2f}' for x, w in zip(functions, [15, 10, 10])))
+
+
+if __name__ == '__main__':
+    main()
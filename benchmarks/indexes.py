@@ -0,0 +1,93 @@
+"""Lookup cost of Database.get_* by booking_id without and with the schema indexes.
+
+Fills a scratch database, drops the indexes to mimic a database created before they
+existed, times the lookups, lets Database.migrate() recreate the indexes and times the
+lookups again. Run from the repository root:
+
+    python -m benchmarks.indexes
+"""
+import os
+import random
+import sqlite3
+import tempfile
+from typing import Dict, Set
+
+from src.book import Database
+from src.models import Base
+from benchmarks.common import measure
+
+N_BOOKINGS = 2000
+N_OCCASIONS = 10
+N_NAMES = 20
+N_LOOKUPS = 50
+
+
+class UnmigratedDatabase(Database):
+    # Behaves like the app did before the indexes existed
+    def migrate(self, new_tables: Set[str] = frozenset()) -> Dict[str, int]:
+        return {}
+
+
+def populate(path: str) -> list:
+    rng = random.Random(0)
+    booking_ids = [f'booking{i:05d}' for i in range(N_BOOKINGS)]
+    connection = sqlite3.connect(path)
+    connection.executemany(
+        'INSERT INTO bookings (booking_id, time_created, next_occasion, title, description, location) '
+        'VALUES (?, ?, ?, ?, ?, ?)',
+        [(x, f'2023-01-01T{i // 3600:02d}:{i // 60 % 60:02d}:{i % 60:02d}', N_OCCASIONS, x, '', '')
+         for i, x in enumerate(booking_ids)]
+        )
+    connection.executemany(
+        'INSERT INTO active (booking_id, is_active) VALUES (?, ?)', [(x, True) for x in booking_ids]
+        )
+    connection.executemany(
+        'INSERT INTO occasions (booking_id, occasion, date, time_start, time_end) VALUES (?, ?, ?, ?, ?)',
+        [(x, o, '2023-06-01', '18:00', '20:00') for x in booking_ids for o in range(N_OCCASIONS)]
+        )
+    connection.executemany(
+        'INSERT INTO answers (booking_id, occasion, name, answer) VALUES (?, ?, ?, ?)',
+        [
+            (x, o, f'name{n}', rng.randint(0, 2))
+            for x in booking_ids for n in range(N_NAMES) for o in range(N_OCCASIONS)
+            ]
+        )
+    connection.executemany(
+        'INSERT INTO comments (booking_id, time_created, name, comment) VALUES (?, ?, ?, ?)',
+        [(x, '2023-01-01T00:00:00', 'name0', 'comment') for x in booking_ids]
+        )
+    connection.commit()
+    connection.close()
+    return booking_ids
+
+
+def lookups(db: Database, booking_ids: list) -> dict:
+    sample = random.Random(1).sample(booking_ids, N_LOOKUPS)
+    return {
+        getter.__name__: measure(lambda: [getter(x) for x in sample], repeat=3) / N_LOOKUPS
+        for getter in [db.get_answers, db.get_occasions, db.get_comments, db.get_active]
+        }
+
+
+def main():
+    path = os.path.join(tempfile.mkdtemp(), 'tables.db')
+    url = f'sqlite+pysqlite:///{path}'
+    Database(url)
+    booking_ids = populate(path)
+
+    connection = sqlite3.connect(path)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            connection.execute(f'DROP INDEX {index.name}')
+    connection.close()
+    before = lookups(UnmigratedDatabase(url), booking_ids)
+    after = lookups(Database(url), booking_ids)
+
+    print(f'{N_BOOKINGS} bookings, {N_BOOKINGS * N_OCCASIONS * N_NAMES} answers, ms per lookup')
+    print(f"{'':>14} {'before':>8} {'after':>8}")
+    for getter in before:
+        print(f'{getter:>14} {before[getter] * 1000:>8.2f} {after[getter] * 1000:>8.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Overhead of the request instrumentation, disabled and enabled.
+
+Each mode runs in a fresh interpreter, since BOOK_METRICS is read when the app is imported.
+A test client requests a poll page with a cold table cache (the heaviest path, every query
+and phase is recorded) and with warm caches. Run from the repository root:
+
+    python -m benchmarks.instrumentation
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+WORKER = '''
+import json
+from app import app, db, cache, fragments
+from benchmarks.common import synthetic_polls, measure
+[booking_id] = synthetic_polls(db, 1, 20, 50)
+client = app.test_client()
+client.post('/login', data={'password': 'bench'})
+
+def cold():
+    for _ in range(20):
+        cache.invalidate(booking_id)
+        fragments.invalidate(booking_id)
+        client.get(f'/show/{booking_id}')
+
+def warm():
+    for _ in range(200):
+        client.get(f'/show/{booking_id}')
+
+print(json.dumps({'cold_ms': measure(cold) / 20 * 1000, 'warm_ms': measure(warm) / 200 * 1000}))
+'''
+
+
+def run(enabled: bool) -> dict:
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = {
+        **os.environ,
+        'PASSWORD': 'bench',
+        'BOOK_METRICS': 'true' if enabled else 'false',
+        'BOOK_DATABASE_URL': f'sqlite+pysqlite:///{os.path.join(tempfile.mkdtemp(), "tables.db")}',
+        }
+    output = subprocess.run([sys.executable, '-c', WORKER], cwd=root, env=env, capture_output=True, check=True)
+    return json.loads(output.stdout)
+
+
+def main():
+    print(f"{'metrics':>8} {'cold show (ms)':>15} {'warm show (ms)':>15}")
+    for enabled in [False, True]:
+        result = run(enabled)
+        print(f"{'on' if enabled else 'off':>8} {result['cold_ms']:>15.3f} {result['warm_ms']:>15.3f}")
+
+
+if __name__ == '__main__':
+    main()
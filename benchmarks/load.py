@@ -0,0 +1,150 @@
+"""End-to-end load driver for the Flask routes, reported as JSON.
+
+Synthetic polls are loaded into a scratch database, the app is served by a local threaded
+WSGI server (or called through Flask's test client with --client test), and concurrent
+simulated users log in and then browse the front page, view polls, answer and comment in a
+weighted mix for a fixed duration. The report holds p50/p95/p99 latency per route, the
+throughput and the error count, and can be compared between runs with benchmarks.compare.
+Run from the repository root:
+
+    python -m benchmarks.load [--users 16] [--duration 20] [--client wsgi|test] [--output load.json]
+"""
+import argparse
+import http.cookiejar
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import synthetic_polls, percentiles, write_report
+
+# Relative frequency of each user action
+WEIGHTS = {'index': 2, 'show': 6, 'answer': 1, 'comment': 1}
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    # Time each request on its own, the page a form redirects to is requested by the next action
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+def wsgi_client(base_url: str):
+    opener = urllib.request.build_opener(
+        urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect()
+        )
+
+    def request(method: str, path: str, data: dict = None) -> int:
+        body = urllib.parse.urlencode(data, doseq=True).encode() if data is not None else None
+        try:
+            with opener.open(urllib.request.Request(base_url + path, body, method=method)) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as error:
+            return error.code
+
+    return request
+
+
+def test_client(app):
+    client = app.test_client()
+
+    def request(method: str, path: str, data: dict = None) -> int:
+        return client.open(path, method=method, data=data).status_code
+
+    return request
+
+
+def user(request, booking_ids: list, n_occasions: int, deadline: float, seed: int) -> list:
+    # (route, seconds, status) of every request one simulated user makes before the deadline
+    rng = random.Random(seed)
+    request('POST', '/login', {'password': os.environ['PASSWORD']})
+    actions = list(WEIGHTS)
+    weights = list(WEIGHTS.values())
+    samples = []
+    i = 0
+    while time.perf_counter() < deadline:
+        action = rng.choices(actions, weights)[0]
+        booking_id = rng.choice(booking_ids)
+        name = f'user{seed}-{i}'
+        i += 1
+        start = time.perf_counter()
+        if action == 'index':
+            status = request('GET', '/')
+        elif action == 'show':
+            status = request('GET', f'/show/{booking_id}')
+        elif action == 'answer':
+            answers = [rng.choice(['❌', '✅', '❓']) for _ in range(n_occasions)]
+            status = request(
+                'POST', f'/answer/{booking_id}', {'name': name, 'comment': '', 'tristate_answers': answers}
+                )
+        else:
+            status = request('POST', f'/comment/{booking_id}', {'name': name, 'comment': 'Comment'})
+        samples.append((action, time.perf_counter() - start, status))
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--client', choices=['wsgi', 'test'], default='wsgi')
+    parser.add_argument('--users', type=int, default=16, help='Concurrent simulated users')
+    parser.add_argument('--duration', type=float, default=20.0, help='Seconds of load')
+    parser.add_argument('--polls', type=int, default=200)
+    parser.add_argument('--occasions', type=int, default=20)
+    parser.add_argument('--names', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='-', help='Report file, standard output by default')
+    args = parser.parse_args()
+
+    os.environ.setdefault('PASSWORD', 'bench')
+    os.environ.setdefault('BOOK_DATABASE_URL', f'sqlite+pysqlite:///{os.path.join(tempfile.mkdtemp(), "tables.db")}')
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from app import app, db
+    booking_ids = synthetic_polls(db, args.polls, args.occasions, args.names, seed=args.seed)
+
+    server = None
+    if args.client == 'wsgi':
+        from werkzeug.serving import make_server
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        clients = [wsgi_client(f'http://127.0.0.1:{server.server_port}') for _ in range(args.users)]
+    else:
+        clients = [test_client(app) for _ in range(args.users)]
+
+    start = time.perf_counter()
+    deadline = start + args.duration
+    with ThreadPoolExecutor(args.users) as executor:
+        samples = sum(executor.map(
+            lambda x: user(clients[x], booking_ids, args.occasions, deadline, args.seed * 1000 + x),
+            range(args.users),
+            ), [])
+    seconds = time.perf_counter() - start
+    if server is not None:
+        server.shutdown()
+
+    results = {}
+    for action in WEIGHTS:
+        timings = [x[1] for x in samples if x[0] == action]
+        if timings:
+            results[action] = percentiles(timings)
+    results['all'] = {**percentiles([x[1] for x in samples]), 'per_s': round(len(samples) / seconds, 1)}
+    errors = sum(1 for x in samples if x[2] >= 400)
+    write_report({
+        'benchmark': 'load',
+        'config': {**vars(args), 'python': platform.python_version()},
+        'results': results,
+        'errors': errors,
+        }, args.output)
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()
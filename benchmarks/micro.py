@@ -0,0 +1,78 @@
+"""Micro-benchmarks of the data layer hot paths, reported as JSON.
+
+Synthetic polls are loaded into a scratch SQLite database (or the database given with
+--url, whose tables are used as they are), then every operation is timed per call on
+randomly chosen polls. The report holds p50/p95/p99 latency and calls per second of each
+operation, and can be compared between runs with benchmarks.compare. Run from the
+repository root:
+
+    python -m benchmarks.micro [--polls 200] [--occasions 20] [--names 30] [--output micro.json]
+"""
+import argparse
+import os
+import platform
+import random
+import tempfile
+import time
+
+from src.book import Database, BookingManager, RenderCache
+from benchmarks.common import synthetic_polls, percentiles, write_report
+
+
+def operations(db: Database, booking_ids: list, n_occasions: int) -> dict:
+    # Callables taking a booking id, each timed separately
+    cache = RenderCache(len(booking_ids) * 2)
+    for booking_id in booking_ids:
+        BookingManager(booking_id, db, cache).to_table()
+    names = iter(range(10 ** 9))
+    return {
+        'get_booking': lambda x: db.get_booking(x),
+        'get_occasions': lambda x: db.get_occasions(x),
+        'get_answers': lambda x: db.get_answers(x),
+        'get_tallies': lambda x: db.get_tallies(x),
+        'get_comments': lambda x: db.get_comments(x),
+        'get_active': lambda x: db.get_active(x),
+        'to_table_cold': lambda x: BookingManager(x, db, RenderCache()).to_table(),
+        'to_table_warm': lambda x: BookingManager(x, db, cache).to_table(),
+        'index_list': lambda x: BookingManager(db=db).index_list(10),
+        'index_list_page_5': lambda x: BookingManager(db=db).index_list(10, 40),
+        'add_answers': lambda x: BookingManager(x, db).add_answers(
+            list(range(n_occasions)), f'bench{next(names)}', [1] * n_occasions
+            ),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='', help='SQLAlchemy URL, a scratch SQLite database by default')
+    parser.add_argument('--polls', type=int, default=200)
+    parser.add_argument('--occasions', type=int, default=20)
+    parser.add_argument('--names', type=int, default=30)
+    parser.add_argument('--calls', type=int, default=200, help='Timed calls per operation')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='-', help='Report file, standard output by default')
+    args = parser.parse_args()
+
+    url = args.url or f'sqlite+pysqlite:///{os.path.join(tempfile.mkdtemp(), "tables.db")}'
+    db = Database(url)
+    booking_ids = synthetic_polls(db, args.polls, args.occasions, args.names, seed=args.seed)
+    rng = random.Random(args.seed)
+    results = {}
+    for name, operation in operations(db, booking_ids, args.occasions).items():
+        timings = []
+        for _ in range(args.calls):
+            booking_id = rng.choice(booking_ids)
+            start = time.perf_counter()
+            operation(booking_id)
+            timings.append(time.perf_counter() - start)
+        results[name] = {**percentiles(timings), 'per_s': round(len(timings) / sum(timings), 1)}
+
+    write_report({
+        'benchmark': 'micro',
+        'config': {**vars(args), 'url': db.engine.url.render_as_string(), 'python': platform.python_version()},
+        'results': results,
+        }, args.output)
+
+
+if __name__ == '__main__':
+    main()
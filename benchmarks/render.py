@@ -0,0 +1,84 @@
+"""Render time of the show and answer pages for polls with many respondents.
+
+The legacy header template tested every column against the list of names, a linear
+scan per header cell. It is timed against the per-column flags of to_table, and full
+page renders are timed with an empty (cold) and a filled (warm) fragment cache.
+Run from the repository root:
+
+    python -m benchmarks.render
+"""
+import os
+import tempfile
+
+os.environ.setdefault('BOOK_DATABASE_URL', f'sqlite+pysqlite:///{os.path.join(tempfile.mkdtemp(), "tables.db")}')
+
+import app as application  # noqa: E402
+from src.book import BookingManager, RenderCache  # noqa: E402
+from benchmarks.common import measure  # noqa: E402
+
+SIZES = [(10, 100), (20, 300), (30, 600)]
+
+LEGACY_HEADER = '''
+{% for column in booking['header']['show'] %}
+{% if column in booking['names'] %}<th class="rotate">{{ column }}</th>{% else %}<th></th>{% endif %}
+{% endfor %}
+'''
+
+FLAGGED_HEADER = '''
+{% for column in booking['header']['show'] %}
+{% if booking['name_columns']['show'][loop.index0] %}<th class="rotate">{{ column }}</th>{% else %}<th></th>{% endif %}
+{% endfor %}
+'''
+
+
+def synthetic_poll(n_occasions: int, n_names: int) -> str:
+    b = BookingManager(db=application.db, cache=application.cache)
+    b.new_context()
+    b.add_occasions(['2023-06-01'] * n_occasions, ['18:00'] * n_occasions, ['20:00'] * n_occasions)
+    occasions = b.occasions_list()
+    for n in range(n_names):
+        b.add_answers(occasions, f'name{n}', [n % 3] * n_occasions)
+    return b.booking_id
+
+
+def render_page(booking_id: str, view: str) -> str:
+    booking = application.manager(booking_id).to_table()
+    if view == 'answer':
+        booking['tristates'] = ['\u274C', '\u2705', '\u2753']
+        booking['tristate_answers'] = [booking['tristates'][x] for x in booking['edit_answers']]
+    return application.render_template(f'{view}.html', booking_id=booking_id, booking=booking, edit=False)
+
+
+def cold(booking_id: str, view: str) -> None:
+    application.fragments = RenderCache(application.app.config['FRAGMENT_CACHE_SIZE'])
+    render_page(booking_id, view)
+
+
+def main():
+    flask_app = application.app
+    legacy = flask_app.jinja_env.from_string(LEGACY_HEADER)
+    flagged = flask_app.jinja_env.from_string(FLAGGED_HEADER)
+    print(
+        f"{'occasions':>10} {'names':>6} {'header scan (ms)':>17} {'header flags (ms)':>18}"
+        f" {'show cold (ms)':>15} {'show warm (ms)':>15} {'answer cold (ms)':>17} {'answer warm (ms)':>17}"
+        )
+    for n_occasions, n_names in SIZES:
+        booking_id = synthetic_poll(n_occasions, n_names)
+        with flask_app.test_request_context():
+            booking = application.manager(booking_id).to_table()
+            scan = measure(lambda: legacy.render(booking=booking))
+            flags = measure(lambda: flagged.render(booking=booking))
+            timings = []
+            for view in ['show', 'answer']:
+                timings.append(measure(lambda: cold(booking_id, view)))
+                render_page(booking_id, view)
+                timings.append(measure(lambda: render_page(booking_id, view)))
+        print(
+            f'{n_occasions:>10} {n_names:>6} {scan * 1000:>17.2f} {flags * 1000:>18.2f}'
+            f' {timings[0] * 1000:>15.2f} {timings[1] * 1000:>15.2f}'
+            f' {timings[2] * 1000:>17.2f} {timings[3] * 1000:>17.2f}'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Reader latency and lock errors on SQLite while writers hold transactions, by connection settings.
+
+Writer threads keep a write transaction open for a while after writing, as a slow request
+or an import does, then commit. Meanwhile reader threads make the lookups a page starts
+with, the version and the answers of a poll, and each read's latency and every "database is
+locked" error is recorded. With the default rollback journal a commit locks readers out;
+with WAL they read the last committed state, and the busy timeout makes writers wait for
+each other instead of failing. Each configuration gets its own scratch database file, since
+the journal mode is stored in the file. Run from the repository root:
+
+    python -m benchmarks.sqlite_load [--hold 0.02] [--seconds 5]
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError
+
+from src.book import DEFAULT_SQLITE_PRAGMAS, Database
+from src.models import Comment
+from benchmarks.common import synthetic_polls, percentiles
+
+N_BOOKINGS = 20
+
+CONFIGURATIONS = {
+    # SQLite's own defaults, without the busy timeout of 5 s that the Python driver sets
+    'sqlite': {'busy_timeout': 0},
+    'driver': {},
+    'tuned': DEFAULT_SQLITE_PRAGMAS,
+    }
+
+
+def run(pragmas: dict, args: argparse.Namespace) -> dict:
+    url = f'sqlite+pysqlite:///{os.path.join(tempfile.mkdtemp(), "tables.db")}'
+    db = Database(url, pragmas, pool_size=args.readers + args.writers)
+    booking_ids = synthetic_polls(db, N_BOOKINGS, 10, 20)
+
+    reads = []
+    counts = {'writes': 0, 'read_locked': 0, 'write_locked': 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.seconds
+
+    def read(seed: int) -> None:
+        rng = random.Random(seed)
+        while time.perf_counter() < deadline:
+            booking_id = rng.choice(booking_ids)
+            start = time.perf_counter()
+            try:
+                db.get_version(booking_id)
+                db.get_answers(booking_id)
+            except OperationalError:
+                with lock:
+                    counts['read_locked'] += 1
+                continue
+            with lock:
+                reads.append(time.perf_counter() - start)
+
+    def write(seed: int) -> None:
+        rng = random.Random(seed)
+        i = 0
+        while time.perf_counter() < deadline:
+            row = {'booking_id': rng.choice(booking_ids), 'time_created': '', 'name': f'w{seed}', 'comment': str(i)}
+            try:
+                with db.engine.begin() as connection:
+                    connection.execute(insert(Comment), row)
+                    time.sleep(args.hold)
+                result = 'writes'
+            except OperationalError:
+                result = 'write_locked'
+            with lock:
+                counts[result] += 1
+            i += 1
+
+    threads = [threading.Thread(target=read, args=(x,)) for x in range(args.readers)]
+    threads += [threading.Thread(target=write, args=(x,)) for x in range(args.writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    db.engine.dispose()
+    return {
+        **percentiles(reads),
+        'reads_per_s': len(reads) / args.seconds,
+        'writes_per_s': counts['writes'] / args.seconds,
+        'read_locked': counts['read_locked'],
+        'write_locked': counts['write_locked'],
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--hold', type=float, default=0.02, help='Seconds each write transaction stays open')
+    parser.add_argument('--seconds', type=float, default=5.0, help='Seconds per configuration')
+    args = parser.parse_args()
+    print(f'{args.readers} readers, {args.writers} writers holding transactions for {args.hold * 1000:.0f} ms, '
+          f'{args.seconds:.0f} s per configuration')
+    print(f"{'':>8} {'read p50 (ms)':>14} {'read p99 (ms)':>14} {'reads/s':>8} {'writes/s':>9}"
+          f" {'read locked':>12} {'write locked':>13}")
+    for name, pragmas in CONFIGURATIONS.items():
+        result = run(pragmas, args)
+        print(
+            f"{name:>8} {result['p50_ms']:>14.2f} {result['p99_ms']:>14.2f} {result['reads_per_s']:>8.0f}"
+            f" {result['writes_per_s']:>9.0f} {result['read_locked']:>12} {result['write_locked']:>13}"
+            )
+
+
+if __name__ == '__main__':
+    main()
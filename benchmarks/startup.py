@@ -0,0 +1,55 @@
+"""Cold start time and peak memory of a worker, with and without pandas.
+
+Each path runs in a fresh interpreter that imports the app modules, opens a scratch
+database and reads one poll. The pandas path additionally loads the poll through
+Database.get_frame, as every read did before the data layer moved to plain rows.
+Run from the repository root:
+
+    python -m benchmarks.startup
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+REPEAT = 5
+
+WORKER = '''
+import json, resource, sys, time
+start = time.perf_counter()
+from src.book import Database, BookingManager
+b = BookingManager(db=Database(sys.argv[1]))
+b.new_context()
+b.add_occasions(['2023-06-01'] * 10, ['18:00'] * 10, ['20:00'] * 10)
+b.add_answers(b.occasions_list(), 'name', [1] * 10)
+b.to_table()
+if sys.argv[2] == 'pandas':
+    b.db.get_frame(b.db.answercolumns, b.booking_id)
+seconds = time.perf_counter() - start
+print(json.dumps({'seconds': seconds, 'maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+'''
+
+
+def run(path: str) -> dict:
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = []
+    for _ in range(REPEAT):
+        url = f'sqlite+pysqlite:///{os.path.join(tempfile.mkdtemp(), "tables.db")}'
+        output = subprocess.run([sys.executable, '-c', WORKER, url, path], cwd=root, capture_output=True, check=True)
+        results.append(json.loads(output.stdout))
+    return {
+        'seconds': min(x['seconds'] for x in results),
+        'maxrss_kb': min(x['maxrss_kb'] for x in results),
+        }
+
+
+def main():
+    print(f"{'path':>8} {'start (ms)':>11} {'max RSS (MB)':>13}")
+    for path in ['rows', 'pandas']:
+        result = run(path)
+        print(f"{path:>8} {result['seconds'] * 1000:>11.0f} {result['maxrss_kb'] / 1024:>13.1f}")
+
+
+if __name__ == '__main__':
+    main()
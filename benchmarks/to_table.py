@@ -0,0 +1,45 @@
+"""Scaling of the answer grid behind BookingManager.to_table.
+
+Run from the repository root:
+
+    python -m benchmarks.to_table
+"""
+import os
+import tempfile
+
+from pandas import DataFrame
+
+from src.book import Database, BookingManager
+from benchmarks.common import measure, synthetic_rows
+
+SIZES = [(5, 10), (15, 50), (30, 100), (60, 200)]
+
+
+def nested_grid(answers, occasions, names):
+    # The original implementation: one boolean mask lookup per occasion and name
+    grid = []
+    for occasion in occasions:
+        occasion_loc = (answers['occasion'] == occasion)
+        row = []
+        for name in names:
+            answer = answers.loc[occasion_loc & (answers['name'] == name), ['answer']]
+            row.append(answer.iloc[0, 0] if len(answer) else 0)
+        grid.append(row)
+    return grid
+
+
+def main():
+    b = BookingManager(db=Database(f'sqlite+pysqlite:///{os.path.join(tempfile.mkdtemp(), "tables.db")}'))
+    print(f"{'occasions':>10} {'names':>6} {'nested (ms)':>12} {'grid (ms)':>10} {'speedup':>8}")
+    for n_occasions, n_names in SIZES:
+        occasions, answers = synthetic_rows(n_occasions, n_names)
+        occasion_ids = [x.occasion for x in occasions]
+        names = list(dict.fromkeys(x.name for x in answers))
+        frame = DataFrame(answers)
+        nested = measure(lambda: nested_grid(frame, occasion_ids, names), repeat=1)
+        grid = measure(lambda: b.answer_grid(answers, occasion_ids, names))
+        print(f'{n_occasions:>10} {n_names:>6} {nested * 1000:>12.1f} {grid * 1000:>10.2f} {nested / grid:>7.0f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""Throughput and latency of the production server with one and with several worker processes.
+
+Synthetic polls are loaded into a scratch database, then gunicorn is started with
+gunicorn.conf.py, once per worker count. Live result streams are opened on random polls and
+held while the simulated users of benchmarks.load browse, answer and comment from separate
+processes for a fixed duration, as when pages are left open. The report holds p50/p95/p99
+latency and throughput per worker count and the streams that were dropped, and can be
+compared between runs with benchmarks.compare. Requires gunicorn, and gevent for the default
+worker class. Run from the repository root:
+
+    python -m benchmarks.workers [--workers 1 4] [--streams 200] [--users 16] [--duration 20] [--output workers.json]
+"""
+import argparse
+import http.client
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.common import synthetic_polls, percentiles, write_report, free_port, wait_for
+from benchmarks.events import login
+from benchmarks.load import user, wsgi_client
+
+
+def run_user(port: int, booking_ids: list, n_occasions: int, duration: float, seed: int) -> list:
+    return user(wsgi_client(f'http://127.0.0.1:{port}'), booking_ids, n_occasions, time.perf_counter() + duration, seed)
+
+
+def hold(port: int, path: str, cookie: str, ready: threading.Barrier, done: threading.Event, dropped: list) -> None:
+    # Keep one stream open and read, as an open page does, noting it if the server closes it early
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    connection.request('GET', path, headers={'Cookie': cookie, 'Accept': 'text/event-stream'})
+    response = connection.getresponse()
+    response.readline()
+    response.readline()
+    try:
+        ready.wait()
+    except threading.BrokenBarrierError:
+        return
+    while response.readline():
+        pass
+    if not done.is_set():
+        dropped.append(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, os.cpu_count() or 1], help='Worker counts')
+    parser.add_argument('--worker-class', default='gevent', help='gunicorn worker class, gevent or gthread')
+    parser.add_argument('--threads', type=int, default=4, help='Threads per gthread worker')
+    parser.add_argument('--streams', type=int, default=200, help='Live result streams held open during the load')
+    parser.add_argument('--users', type=int, default=16, help='Concurrent simulated users, one process each')
+    parser.add_argument('--duration', type=float, default=20.0, help='Seconds of load per worker count')
+    parser.add_argument('--polls', type=int, default=200)
+    parser.add_argument('--occasions', type=int, default=20)
+    parser.add_argument('--names', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='-', help='Report file, standard output by default')
+    args = parser.parse_args()
+    if shutil.which('gunicorn') is None:
+        sys.exit('gunicorn is not installed')
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    directory = tempfile.mkdtemp()
+    os.environ.setdefault('PASSWORD', 'bench')
+    from src.book import Database
+    database_url = f'sqlite+pysqlite:///{os.path.join(directory, "tables.db")}'
+    booking_ids = synthetic_polls(Database(database_url), args.polls, args.occasions, args.names, seed=args.seed)
+
+    results = {}
+    errors = 0
+    for n_workers in args.workers:
+        port = free_port()
+        env = {
+            **os.environ,
+            'BOOK_DATABASE_URL': database_url,
+            'BOOK_WORKERS': str(n_workers),
+            'BOOK_WORKER_CLASS': args.worker_class,
+            'BOOK_THREADS': str(args.threads),
+            'BOOK_BIND': f'127.0.0.1:{port}',
+            'BOOK_SECRET_KEY_FILE': os.path.join(directory, 'secret_key'),
+            'BOOK_SHARED_CACHE_PATH': os.path.join(directory, f'cache{n_workers}.db'),
+            }
+        server = subprocess.Popen(
+            ['gunicorn', '-c', 'gunicorn.conf.py', '--log-level', 'warning', 'app:app'], cwd=root, env=env
+            )
+        ready = threading.Barrier(args.streams + 1)
+        done = threading.Event()
+        dropped = []
+        try:
+            wait_for(port)
+            cookie = login(port)
+            with ProcessPoolExecutor(args.users) as executor:
+                # The user processes are forked before the threads holding the streams start
+                list(executor.map(abs, range(args.users)))
+                for booking_id in random.Random(args.seed).choices(booking_ids, k=args.streams):
+                    threading.Thread(
+                        target=hold, args=(port, f'/events/{booking_id}', cookie, ready, done, dropped), daemon=True
+                        ).start()
+                try:
+                    ready.wait(timeout=60)
+                except threading.BrokenBarrierError:
+                    sys.exit(f'{args.worker_class} workers did not open {args.streams} streams within a minute')
+                start = time.perf_counter()
+                samples = sum(executor.map(
+                    run_user,
+                    [port] * args.users,
+                    [booking_ids] * args.users,
+                    [args.occasions] * args.users,
+                    [args.duration] * args.users,
+                    [args.seed * 1000 + x for x in range(args.users)],
+                    ), [])
+                seconds = time.perf_counter() - start
+            done.set()
+        finally:
+            server.terminate()
+            server.wait()
+        results[f'workers_{n_workers}'] = {
+            **percentiles([x[1] for x in samples]), 'per_s': round(len(samples) / seconds, 1),
+            'dropped_streams': len(dropped),
+            }
+        errors += sum(1 for x in samples if x[2] >= 400) + len(dropped)
+
+    write_report({
+        'benchmark': 'workers',
+        'config': {**vars(args), 'cpus': os.cpu_count(), 'python': platform.python_version()},
+        'results': results,
+        'errors': errors,
+        }, args.output)
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+# Production server settings, run with: gunicorn -c gunicorn.conf.py app:app
+import multiprocessing
+import os
+
+bind = os.environ.get('BOOK_BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('BOOK_WORKERS', multiprocessing.cpu_count()))
+# Each open live result stream holds a connection for as long as the page is open, which gevent
+# serves as a greenlet. With BOOK_WORKER_CLASS=gthread each stream holds one of the BOOK_THREADS threads.
+worker_class = os.environ.get('BOOK_WORKER_CLASS', 'gevent')
+worker_connections = int(os.environ.get('BOOK_WORKER_CONNECTIONS', 1000))
+threads = int(os.environ.get('BOOK_THREADS', 4))
+# The app is imported and warmed up once, then the workers are forked from it
+preload_app = True
+
+if worker_class == 'gevent':
+    # Patched before the app is preloaded, so that its locks, queues and connection pools yield to other greenlets
+    from gevent import monkey
+    monkey.patch_all()
+
+# Workers must sign sessions with the same key, and reuse the tables the others built
+if 'BOOK_SECRET_KEY' not in os.environ:
+    os.environ.setdefault('BOOK_SECRET_KEY_FILE', 'data/secret_key')
+if workers > 1:
+    os.environ.setdefault('BOOK_CACHE_BACKEND', 'sqlite')
+
+
+def on_starting(server):
+    from app import warmup
+    warmup(int(os.environ.get('BOOK_WARMUP_BOOKINGS', 50)))
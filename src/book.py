@@ -1,114 +1,647 @@
+import csv
+import io
+import json
+import logging
+import threading
 import uuid
-from datetime import datetime
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timedelta
 from dateutil import tz
-from pandas import DataFrame
-from sqlalchemy import create_engine, select, insert
+from sqlalchemy import (
+    create_engine, event, select, insert, update, delete, func, inspect, tuple_, case, and_, or_, union,
+    )
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import NoResultFound
 from sqlalchemy.orm import Session
-from src.models import Base, Booking, Occasion, Answer, Comment, Active
-from typing import Tuple, List
+from src.models import Base, Booking, Occasion, Answer, Tally, Comment, Active, Archive
+from src.models import BookingRow, OccasionRow, AnswerRow, TallyRow, CommentRow, ActiveRow
+from src.metrics import Metrics, NO_PHASE
+from src.events import EventHub
+from src.formatting import Formatter
+from typing import Callable, Dict, Tuple, List, Optional, NamedTuple, Set, Iterator
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 268435456,
+    'cache_size': -65536,
+    }
+
+
+# Tally column counting each answer value
+TALLY_COLUMNS = ('no', 'yes', 'maybe')
+
+UPSERT_INSERTS = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert,
+    }
+
+# Rows fetched per round trip when streaming query results
+STREAM_BATCH_SIZE = 1000
+
+
+def create_database_engine(url: str, sqlite_pragmas: Optional[dict] = None, **engine_options) -> Engine:
+    # Every new SQLite connection gets the pragmas, WAL lets readers proceed while a poll is answered
+    engine = create_engine(url, **engine_options)
+    if engine.dialect.name == 'sqlite':
+        pragmas = DEFAULT_SQLITE_PRAGMAS if sqlite_pragmas is None else sqlite_pragmas
+
+        @event.listens_for(engine, 'connect')
+        def set_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for pragma, value in pragmas.items():
+                cursor.execute(f'PRAGMA {pragma} = {value}')
+            cursor.close()
+
+    return engine
 
 
 class Database():
-    def __init__(self):
-        self.bookingcolumns = ('booking_id', 'next_occasion', 'title', 'time_created', 'description', 'location')
-        self.occasioncolumns = ('booking_id', 'occasion', 'date', 'time_start', 'time_end')
-        self.answercolumns = ('booking_id', 'occasion', 'name', 'answer')
-        self.commentcolumns = ('booking_id', 'time_created', 'name', 'comment')
-        self.activecolumns = ('booking_id', 'is_active')
-
-        self.engine = create_engine("sqlite+pysqlite:///data/tables.db")
+    def __init__(
+            self, url: str = "sqlite+pysqlite:///data/tables.db", sqlite_pragmas: Optional[dict] = None,
+            **engine_options
+            ):
+        self.bookingcolumns = BookingRow._fields
+        self.occasioncolumns = OccasionRow._fields
+        self.answercolumns = AnswerRow._fields
+        self.tallycolumns = TallyRow._fields
+        self.commentcolumns = CommentRow._fields
+        self.activecolumns = ActiveRow._fields
+
+        self.engine = create_database_engine(url, sqlite_pragmas, **engine_options)
+        new_tables = set(Base.metadata.tables) - set(inspect(self.engine).get_table_names())
         Base.metadata.create_all(self.engine)
         self.model_from_columns = {
             self.bookingcolumns: Booking,
             self.occasioncolumns: Occasion,
             self.answercolumns: Answer,
+            self.tallycolumns: Tally,
             self.commentcolumns: Comment,
             self.activecolumns: Active,
             }
-
-    def add(self, source_df: DataFrame) -> None:
-        Table = self.model_from_columns[tuple(source_df.columns)]
-        rows = [Table(**dict(x[1])) for x in source_df.iterrows()]
+        self.row_from_columns = {
+            self.bookingcolumns: BookingRow,
+            self.occasioncolumns: OccasionRow,
+            self.answercolumns: AnswerRow,
+            self.tallycolumns: TallyRow,
+            self.commentcolumns: CommentRow,
+            self.activecolumns: ActiveRow,
+            }
+        self.migrate(new_tables)
+
+    def migrate(self, new_tables: Set[str] = frozenset()) -> Dict[str, int]:
+        # Add columns, indexes and tallies missing from databases created by older versions, safe to run repeatedly.
+        # Returns the number of duplicate rows deleted per table to create its unique indexes.
+        deleted = {}
+        with self.engine.begin() as connection:
+            inspector = inspect(connection)
+            for table in Base.metadata.sorted_tables:
+                existing = {x['name'] for x in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name in existing:
+                        continue
+                    # Columns added after a table was first created carry a server default for the existing rows
+                    column_type = column.type.compile(connection.dialect)
+                    connection.exec_driver_sql(
+                        f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type} '
+                        f'NOT NULL DEFAULT {column.server_default.arg}'
+                        )
+                existing = {x['name'] for x in inspector.get_indexes(table.name)}
+                for index in table.indexes:
+                    if index.name in existing:
+                        continue
+                    if index.unique:
+                        # Keep the first row of each duplicate, which is the one that was shown
+                        key = table.primary_key.columns.values()[0]
+                        first = select(func.min(key)).group_by(*index.columns)
+                        count = connection.execute(delete(table).where(key.not_in(first))).rowcount
+                        if count:
+                            logger.warning(
+                                'Deleted %d duplicate rows from %s to create %s', count, table.name, index.name
+                                )
+                            deleted[table.name] = deleted.get(table.name, 0) + count
+                    index.create(connection)
+        if 'tallies' in new_tables or 'answers' in deleted:
+            self.rebuild_tallies()
+        return deleted
+
+    def add(self, rows: List[NamedTuple]) -> None:
+        # Bookings and comments only, occasions and answers go through insert_occasions and insert_answers,
+        # which also advance the table version and the tallies
+        if not rows:
+            return
+        Table = self.model_from_columns[rows[0]._fields]
+        if Table not in (Booking, Comment):
+            raise ValueError(f'cannot add {Table.__tablename__} rows')
+        with Session(self.engine) as session, session.begin():
+            session.execute(insert(Table), [row._asdict() for row in rows])
+            if Table is not Booking:
+                for booking_id in {row.booking_id for row in rows}:
+                    self.bump_version(session, booking_id)
+
+    def load(self, rows: List[NamedTuple]) -> None:
+        # Insert complete new bookings in one transaction, counting their tallies from the answers
+        with Session(self.engine) as session, session.begin():
+            self.insert_rows(session, rows)
+
+    def insert_rows(self, session: Session, rows: List[NamedTuple]) -> None:
+        by_columns = {}
+        for row in rows:
+            by_columns.setdefault(row._fields, []).append(row._asdict())
+        counts = {}
+        for row in rows:
+            if isinstance(row, AnswerRow):
+                counts.setdefault((row.booking_id, row.occasion), [0] * len(TALLY_COLUMNS))[row.answer] += 1
+        by_columns[self.tallycolumns] = [TallyRow(*key, *x)._asdict() for key, x in counts.items()]
+        for columns in [self.bookingcolumns, self.activecolumns, self.occasioncolumns, self.answercolumns,
+                        self.tallycolumns, self.commentcolumns]:
+            if by_columns.get(columns):
+                session.execute(insert(self.model_from_columns[columns]), by_columns[columns])
+
+    def existing_bookings(self, booking_ids: List[str]) -> Set[str]:
+        # Archived bookings keep their ids, as they are restored under them
+        statement = union(
+            select(Booking.booking_id).where(Booking.booking_id.in_(booking_ids)),
+            select(Archive.booking_id).where(Archive.booking_id.in_(booking_ids)),
+            )
         with Session(self.engine) as session:
-            session.add_all(rows)
-            session.commit()
+            return set(session.execute(statement).scalars())
 
     def new(self, booking_id: str) -> None:
         time_created = datetime.utcnow().replace(microsecond=0).isoformat()
-        new_booking = DataFrame(
-            {k: [v] for k, v in zip(self.bookingcolumns, [booking_id, 0, "", time_created, "", ""])}
+        self.add([BookingRow(booking_id, 0, "", time_created, "", "", 0, 0)])
+
+    def bump_version(self, session: Session, booking_id: str = '', table: bool = False) -> None:
+        # Every write to a booking advances its version, which identifies what clients have seen,
+        # and writes to occasions or answers also advance the version of its answer table
+        versions = {'version': Booking.version + 1}
+        if table:
+            versions['table_version'] = Booking.table_version + 1
+        statement = update(Booking).values(**versions)
+        if booking_id != '':
+            statement = statement.filter_by(booking_id=booking_id)
+        if session.execute(statement).rowcount == 0 and booking_id != '':
+            # The booking was archived meanwhile, roll back rather than leave rows without a booking
+            raise NoResultFound(f'booking {booking_id} does not exist')
+
+    def get_version(self, booking_id: str) -> Optional[int]:
+        with Session(self.engine) as session:
+            return session.execute(select(Booking.version).filter_by(booking_id=booking_id)).scalar_one_or_none()
+
+    def upsert_statement(self, Table: Base, keys: List[str], columns: List[str]):
+        # INSERT ... ON CONFLICT (keys) DO UPDATE of columns, None for dialects without it
+        dialect_insert = UPSERT_INSERTS.get(self.engine.dialect.name)
+        if dialect_insert is None:
+            return None
+        statement = dialect_insert(Table)
+        return statement.on_conflict_do_update(
+            index_elements=keys, set_={column: statement.excluded[column] for column in columns}
             )
-        self.add(new_booking)
 
     def update(self, variables: dict, selection: dict, Table: Base) -> None:
+        # Update in place and only insert when no row matched, as an upsert where the dialect has one
+        with Session(self.engine) as session, session.begin():
+            result = session.execute(update(Table).filter_by(**selection).values(**variables))
+            if result.rowcount == 0:
+                statement = self.upsert_statement(Table, list(selection), list(variables))
+                if statement is None:
+                    statement = insert(Table)
+                session.execute(statement, {**selection, **variables})
+            self.bump_version(session, selection['booking_id'], table=Table is Answer)
+
+    def insert_occasions(self, booking_id: str, occasions: List[Tuple[str, str, str]]) -> None:
+        # Reserve a block of occasion numbers and write every occasion in one transaction
+        if not occasions:
+            return
+        with Session(self.engine) as session, session.begin():
+            first = self.reserve_occasions(session, booking_id, len(occasions))
+            rows = [
+                OccasionRow(booking_id, first + i, *occasion)._asdict()
+                for i, occasion in enumerate(occasions)
+                ]
+            session.execute(insert(Occasion), rows)
+            self.bump_version(session, booking_id, table=True)
+
+    def add_tallies(self, session: Session, booking_id: str, changes: List[Tuple[int, int, int]]) -> None:
+        # Apply (occasion, answer, +1/-1) changes to the per-occasion answer counts
+        deltas = {}
+        for occasion, answer, change in changes:
+            deltas.setdefault(occasion, dict.fromkeys(TALLY_COLUMNS, 0))[TALLY_COLUMNS[answer]] += change
+        rows = [
+            {'booking_id': booking_id, 'occasion': occasion, **delta}
+            for occasion, delta in deltas.items() if any(delta.values())
+            ]
+        if not rows:
+            return
+        dialect_insert = UPSERT_INSERTS.get(self.engine.dialect.name)
+        if dialect_insert is not None:
+            statement = dialect_insert(Tally)
+            statement = statement.on_conflict_do_update(
+                index_elements=['booking_id', 'occasion'],
+                set_={x: getattr(Tally, x) + statement.excluded[x] for x in TALLY_COLUMNS},
+                )
+            session.execute(statement, rows)
+            return
+        existing = set(session.execute(select(Tally.occasion).filter_by(booking_id=booking_id)).scalars())
+        for row in rows:
+            if row['occasion'] in existing:
+                session.execute(
+                    update(Tally).filter_by(booking_id=booking_id, occasion=row['occasion']).values(
+                        **{x: getattr(Tally, x) + row[x] for x in TALLY_COLUMNS}
+                        )
+                    )
+            else:
+                session.execute(insert(Tally), row)
+
+    def insert_answers(self, booking_id: str, name: str, answers: List[Tuple[int, int]]) -> None:
+        if not answers:
+            return
+        rows = [AnswerRow(booking_id, occasion, name, answer)._asdict() for occasion, answer in answers]
+        with Session(self.engine) as session, session.begin():
+            session.execute(insert(Answer), rows)
+            self.add_tallies(session, booking_id, [(occasion, answer, 1) for occasion, answer in answers])
+            self.bump_version(session, booking_id, table=True)
+
+    def upsert_answers(self, booking_id: str, name: str, answers: List[Tuple[int, int]]) -> None:
+        # Update the answers a name already has and insert the missing ones in one transaction
+        new_answers = dict(answers)
+        if not new_answers:
+            return
+        answers = list(new_answers.items())
+        with Session(self.engine) as session, session.begin():
+            # Counting the new answers first takes the write lock, so the old answers read next stay put
+            self.add_tallies(session, booking_id, [(occasion, answer, 1) for occasion, answer in answers])
+            answer_ids = {}
+            retracted = []
+            existing = select(Answer.answer_id, Answer.occasion, Answer.answer).filter_by(
+                booking_id=booking_id, name=name
+                )
+            for answer_id, occasion, answer in session.execute(existing):
+                answer_ids.setdefault(occasion, []).append(answer_id)
+                if occasion in new_answers:
+                    retracted.append((occasion, answer, -1))
+            self.add_tallies(session, booking_id, retracted)
+            self.bump_version(session, booking_id, table=True)
+
+            statement = self.upsert_statement(Answer, ['booking_id', 'occasion', 'name'], ['answer'])
+            if statement is not None:
+                rows = [AnswerRow(booking_id, occasion, name, answer)._asdict() for occasion, answer in answers]
+                session.execute(statement, rows)
+                return
+            updates = [
+                {'answer_id': x, 'answer': answer}
+                for occasion, answer in answers for x in answer_ids.get(occasion, [])
+                ]
+            inserts = [
+                AnswerRow(booking_id, occasion, name, answer)._asdict()
+                for occasion, answer in answers if occasion not in answer_ids
+                ]
+            if updates:
+                session.execute(update(Answer), updates)
+            if inserts:
+                session.execute(insert(Answer), inserts)
+
+    def counted_answers(self, booking_id: str = ''):
+        # Tallies recounted from the answers table
+        counts = [func.sum(case((Answer.answer == i, 1), else_=0)) for i in range(len(TALLY_COLUMNS))]
+        statement = select(Answer.booking_id, Answer.occasion, *counts).group_by(Answer.booking_id, Answer.occasion)
+        if booking_id != '':
+            statement = statement.filter_by(booking_id=booking_id)
+        return statement
+
+    def rebuild_tallies(self, booking_id: str = '') -> None:
+        with Session(self.engine) as session, session.begin():
+            statement = delete(Tally)
+            if booking_id != '':
+                statement = statement.filter_by(booking_id=booking_id)
+            session.execute(statement)
+            session.execute(insert(Tally.__table__).from_select(self.tallycolumns, self.counted_answers(booking_id)))
+            self.bump_version(session, booking_id, table=True)
+
+    def check_tallies(self, booking_id: str = '') -> List[dict]:
+        # Occasions whose stored tally differs from a recount of their answers
         with Session(self.engine) as session:
-            row = session.execute(select(Table).filter_by(**selection)).scalar_one_or_none()
-            if row is None:
-                _ = session.execute(insert(Table).values(**selection))
-                session.commit()
-                row = session.execute(select(Table).filter_by(**selection)).scalar_one()
-            for column, value in variables.items():
-                setattr(row, column, value)
-            session.commit()
+            counted = {(x[0], x[1]): tuple(x[2:]) for x in session.execute(self.counted_answers(booking_id))}
+        stored = {(x.booking_id, x.occasion): tuple(x[2:]) for x in self.get_tallies(booking_id)}
+        drift = []
+        for key in sorted(set(counted) | set(stored)):
+            expected = counted.get(key, (0, 0, 0))
+            found = stored.get(key, (0, 0, 0))
+            if found != expected:
+                drift.append({'booking_id': key[0], 'occasion': key[1], 'stored': found, 'counted': expected})
+        return drift
 
     def update_bookings(self, variables: dict, selection: dict) -> None:
         self.update(variables, selection, Booking)
 
     def update_answers(self, variables: dict, selection: dict) -> None:
-        self.update(variables, selection, Answer)
+        self.upsert_answers(selection['booking_id'], selection['name'], [(selection['occasion'], variables['answer'])])
 
     def update_active(self, variables: dict, selection: dict) -> None:
         self.update(variables, selection, Active)
 
-    def get(self, columns: Tuple[str], booking_id: str = '') -> DataFrame:
+    def get(self, columns: Tuple[str], booking_id: str = '') -> List[NamedTuple]:
         Table = self.model_from_columns[columns]
+        Row = self.row_from_columns[columns]
+        statement = select(*[getattr(Table, column) for column in columns]).order_by(*Table.__table__.primary_key)
+        if booking_id != '':
+            statement = statement.filter_by(booking_id=booking_id)
         with Session(self.engine) as session:
-            if booking_id != '':
-                rows = [x[0] for x in session.execute(select(Table).filter_by(booking_id=booking_id)).all()]
-            else:
-                rows = session.query(Table).all()
-        data = [[getattr(row, col) for row in rows] for col in columns]
-        df = DataFrame(dict(zip(columns, data)))
-        return df
+            return [Row(*x) for x in session.execute(statement)]
+
+    def get_frame(self, columns: Tuple[str], booking_id: str = ''):
+        # Optional pandas view of a table for analysis, pandas is imported on first use only
+        from pandas import DataFrame
+        return DataFrame(self.get(columns, booking_id), columns=list(columns))
 
-    def get_bookings(self, booking_id: str = '') -> DataFrame:
+    def get_bookings(self, booking_id: str = '') -> List[BookingRow]:
         return self.get(self.bookingcolumns, booking_id)
 
-    def get_occasions(self, booking_id: str = '') -> DataFrame:
+    def get_occasions(self, booking_id: str = '') -> List[OccasionRow]:
         return self.get(self.occasioncolumns, booking_id)
 
-    def get_answers(self, booking_id: str = '') -> DataFrame:
+    def get_answers(self, booking_id: str = '') -> List[AnswerRow]:
         return self.get(self.answercolumns, booking_id)
 
-    def get_comments(self, booking_id: str = '') -> DataFrame:
+    def get_tallies(self, booking_id: str = '') -> List[TallyRow]:
+        return self.get(self.tallycolumns, booking_id)
+
+    def get_comments(self, booking_id: str = '') -> List[CommentRow]:
         return self.get(self.commentcolumns, booking_id)
 
-    def get_active(self, booking_id: str = '') -> DataFrame:
+    def get_active(self, booking_id: str = '') -> List[ActiveRow]:
         return self.get(self.activecolumns, booking_id)
 
+    def get_name_answers(self, booking_id: str, name: str) -> List[AnswerRow]:
+        statement = select(*[getattr(Answer, x) for x in self.answercolumns]).filter_by(
+            booking_id=booking_id, name=name
+            ).order_by(Answer.answer_id)
+        with Session(self.engine) as session:
+            return [AnswerRow(*x) for x in session.execute(statement)]
+
+    def count_names(self, booking_id: str) -> int:
+        statement = select(func.count(Answer.name.distinct())).filter_by(booking_id=booking_id)
+        with Session(self.engine) as session:
+            return session.execute(statement).scalar_one()
+
+    def get_index(self, n: int, offset: int = 0, before: str = '') -> List[dict]:
+        # Newest active bookings, optionally only those listed after the booking_id in before
+        columns = (Booking.booking_id, Booking.title, Booking.time_created, Booking.description)
+        statement = select(*columns).outerjoin(Active, Active.booking_id == Booking.booking_id).where(
+            Active.is_active.is_not(False)
+            ).order_by(Booking.time_created.desc(), Booking.booking_id.desc()).limit(n).offset(offset)
+        with Session(self.engine) as session:
+            if before != '':
+                cursor = session.get(Booking, before)
+                if cursor is not None:
+                    statement = statement.where(
+                        tuple_(Booking.time_created, Booking.booking_id) < (cursor.time_created, cursor.booking_id)
+                        )
+            return [row._asdict() for row in session.execute(statement)]
+
+    def stream(self, statement, batch_size: int = STREAM_BATCH_SIZE) -> Iterator[tuple]:
+        # Rows fetched in batches from an open cursor, server side where the dialect supports it,
+        # the connection is returned to the pool when the generator is exhausted or closed
+        with self.engine.connect() as connection:
+            result = connection.execution_options(yield_per=batch_size).execute(statement)
+            for partition in result.partitions():
+                yield from partition
+
+    def stream_answers(self, booking_id: str = '') -> Iterator[tuple]:
+        # Answers with their booking and occasion in table order, of one booking or of every active booking
+        statement = select(
+            Booking.booking_id, Booking.title, Occasion.date, Occasion.time_start, Occasion.time_end,
+            Answer.name, Answer.answer,
+            ).join(Occasion, Occasion.booking_id == Booking.booking_id).join(
+                Answer, and_(Answer.booking_id == Occasion.booking_id, Answer.occasion == Occasion.occasion)
+            ).order_by(
+                Booking.time_created, Booking.booking_id, Occasion.date, Occasion.time_start, Occasion.occasion,
+                Answer.answer_id,
+            )
+        if booking_id != '':
+            statement = statement.where(Booking.booking_id == booking_id)
+        else:
+            statement = statement.outerjoin(Active, Active.booking_id == Booking.booking_id).where(
+                Active.is_active.is_not(False)
+                )
+        return self.stream(statement)
+
+    def stream_top_occasions(self, booking_id: str, top: int = 1) -> Iterator[tuple]:
+        # Answered occasions among the top ranks by yes-votes, ranked densely as in the table
+        answered = Tally.no + Tally.yes + Tally.maybe > 0
+        votes = select(Tally.yes).where(Tally.booking_id == booking_id, answered).distinct().order_by(
+            Tally.yes.desc()
+            ).limit(top).subquery()
+        statement = select(
+            Occasion.occasion, Occasion.date, Occasion.time_start, Occasion.time_end, Tally.yes
+            ).join(Tally, and_(Tally.booking_id == Occasion.booking_id, Tally.occasion == Occasion.occasion)).where(
+                Occasion.booking_id == booking_id, answered,
+                Tally.yes >= select(func.min(votes.c.yes)).scalar_subquery(),
+            ).order_by(Occasion.date, Occasion.time_start, Occasion.occasion)
+        return self.stream(statement)
+
+    def archive_candidates(self, inactive: bool = True, created_before: str = '', n: int = 500) -> List[str]:
+        # Oldest bookings that are hidden, or were created before a UTC time in ISO format
+        conditions = []
+        if inactive:
+            conditions.append(Active.is_active.is_(False))
+        if created_before != '':
+            conditions.append(Booking.time_created < created_before)
+        if not conditions:
+            return []
+        statement = select(Booking.booking_id).outerjoin(Active, Active.booking_id == Booking.booking_id).where(
+            or_(*conditions)
+            ).order_by(Booking.time_created, Booking.booking_id).limit(n)
+        with Session(self.engine) as session:
+            return list(session.execute(statement).scalars())
+
+    def archive(self, booking_ids: List[str]) -> int:
+        # Move bookings with all their rows into one compressed archive row each, in one transaction
+        if not booking_ids:
+            return 0
+        time_archived = datetime.utcnow().replace(microsecond=0).isoformat()
+        tables = [
+            (self.bookingcolumns, Booking), (self.activecolumns, Active), (self.occasioncolumns, Occasion),
+            (self.answercolumns, Answer), (self.commentcolumns, Comment),
+            ]
+        with Session(self.engine) as session, session.begin():
+            # Writes to the bookings wait until they are archived, so none is deleted without being archived
+            self.lock_bookings(session, booking_ids)
+            archives = {x: {'format': 1} for x in booking_ids}
+            for columns, Table in tables:
+                statement = select(*[getattr(Table, x) for x in columns]).where(
+                    Table.booking_id.in_(booking_ids)
+                    ).order_by(*Table.__table__.primary_key)
+                for x in archives.values():
+                    x[Table.__tablename__] = []
+                for row in session.execute(statement):
+                    archives[row.booking_id][Table.__tablename__].append(list(row))
+            rows = [
+                {'booking_id': x, 'time_archived': time_archived, 'data': zlib.compress(json.dumps(data).encode())}
+                for x, data in archives.items() if data['bookings']
+                ]
+            if rows:
+                session.execute(insert(Archive), rows)
+            for Table in [Tally, Answer, Comment, Occasion, Active, Booking]:
+                session.execute(delete(Table).where(Table.booking_id.in_(booking_ids)))
+        return len(rows)
+
+    def lock_bookings(self, session: Session, booking_ids: List[str]) -> None:
+        # Take the write lock before the transaction reads: the whole database on SQLite, which has no row locks,
+        # else the rows that every write to a booking references or updates the version of, before any of them
+        # takes its foreign key locks, so a late write waits and then finds its booking gone
+        if self.engine.dialect.name == 'sqlite':
+            session.connection().exec_driver_sql('BEGIN IMMEDIATE')
+            return
+        for Table in [Booking, Occasion]:
+            session.execute(select(Table.booking_id).where(Table.booking_id.in_(booking_ids)).with_for_update())
+
+    def restore(self, booking_id: str) -> bool:
+        # Move an archived booking back, False when it is not archived or another request restored it first
+        with Session(self.engine) as session:
+            if session.get(Archive, booking_id) is None:
+                return False
+        with Session(self.engine) as session, session.begin():
+            statement = delete(Archive).filter_by(booking_id=booking_id)
+            if self.engine.dialect.delete_returning:
+                data = session.execute(statement.returning(Archive.data)).scalar_one_or_none()
+            else:
+                # SQLite before 3.35 has no RETURNING, the delete tells whether this transaction got the row
+                data = session.execute(select(Archive.data).filter_by(booking_id=booking_id)).scalar_one_or_none()
+                if data is not None and session.execute(statement).rowcount == 0:
+                    data = None
+            if data is None:
+                return False
+            archive = json.loads(zlib.decompress(data))
+            rows = []
+            for Row in [BookingRow, ActiveRow, OccasionRow, AnswerRow, CommentRow]:
+                Table = self.model_from_columns[Row._fields]
+                rows.extend(Row(*x) for x in archive[Table.__tablename__])
+            self.insert_rows(session, rows)
+        return True
+
+    def compact(self) -> None:
+        # Reclaim the space of deleted rows and refresh the planner statistics, outside of a transaction
+        with self.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            if self.engine.dialect.name == 'sqlite':
+                connection.exec_driver_sql('VACUUM')
+                connection.exec_driver_sql('PRAGMA wal_checkpoint(TRUNCATE)')
+                connection.exec_driver_sql('PRAGMA optimize')
+            elif self.engine.dialect.name == 'postgresql':
+                connection.exec_driver_sql('VACUUM ANALYZE')
+            else:
+                connection.exec_driver_sql('ANALYZE')
+
+    def size(self) -> Optional[int]:
+        # Bytes used by a SQLite database, None for other backends
+        if self.engine.dialect.name != 'sqlite':
+            return None
+        with self.engine.connect() as connection:
+            page_count = connection.exec_driver_sql('PRAGMA page_count').scalar()
+            return page_count * connection.exec_driver_sql('PRAGMA page_size').scalar()
+
+    def reserve_occasions(self, session: Session, booking_id: str, n: int = 1) -> int:
+        # Atomically advance next_occasion by n and return the first reserved number
+        statement = update(Booking).filter_by(booking_id=booking_id).values(
+            next_occasion=Booking.next_occasion + n
+            )
+        if self.engine.dialect.update_returning:
+            return session.execute(statement.returning(Booking.next_occasion)).scalar_one() - n
+        # SQLite before 3.35 has no RETURNING, the update holds the write lock until the read in the same transaction
+        session.execute(statement)
+        return session.execute(select(Booking.next_occasion).filter_by(booking_id=booking_id)).scalar_one() - n
+
     def get_occasion(self, booking_id: str) -> int:
-        booking = self.get_bookings(booking_id)
-        occasion = int(booking['next_occasion'].iloc[0])
-        self.update_bookings({'next_occasion': occasion + 1}, {'booking_id': booking_id})
-        return occasion
+        with Session(self.engine) as session, session.begin():
+            return self.reserve_occasions(session, booking_id)
 
     def get_booking(self, booking_id: str) -> dict:
-        bookings = self.get_bookings()
-        details = bookings.loc[bookings.booking_id == booking_id].to_dict('records')[0]
-        return details
+        with Session(self.engine) as session:
+            booking = session.get(Booking, booking_id)
+            return {column: getattr(booking, column) for column in self.bookingcolumns}
+
+
+class RenderCache():
+    # Entries are served only while the booking is still at the version they were built at, which the
+    # database holds, so writes by other processes or hosts make them stale as well as writes by this one
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.keys_by_booking = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, booking_id: str, key: str, version: int):
+        entry = (booking_id, key)
+        with self.lock:
+            if self.entries.get(entry, (None,))[0] != version:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(entry)
+            self.hits += 1
+            return self.entries[entry][1]
+
+    def put(self, booking_id: str, key: str, value, version: int) -> None:
+        entry = (booking_id, key)
+        with self.lock:
+            self.entries[entry] = (version, value)
+            self.entries.move_to_end(entry)
+            self.keys_by_booking.setdefault(booking_id, set()).add(entry)
+            while len(self.entries) > self.maxsize:
+                self.discard(next(iter(self.entries)))
+                self.evictions += 1
+
+    def discard(self, entry: Tuple[str, str]) -> None:
+        del self.entries[entry]
+        keys = self.keys_by_booking[entry[0]]
+        keys.discard(entry)
+        if not keys:
+            del self.keys_by_booking[entry[0]]
+
+    def invalidate(self, booking_id: str) -> None:
+        # Stale entries are never served, dropping them only frees their memory
+        with self.lock:
+            for entry in list(self.keys_by_booking.get(booking_id, ())):
+                self.discard(entry)
+
+    def info(self) -> dict:
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self.entries),
+                'maxsize': self.maxsize,
+                }
 
 
 class BookingManager():
-    def __init__(self):
-        self.booking_id = ""
+    # One manager per request, sharing a Database and a RenderCache between requests
+    def __init__(
+            self, booking_id: str = "", db: Optional[Database] = None, cache: Optional[RenderCache] = None,
+            metrics: Optional[Metrics] = None, events: Optional[EventHub] = None,
+            formatter: Optional[Formatter] = None,
+            ):
+        self.booking_id = booking_id
         self.columns_translation = {
             'date': 'Datum',
             'time_start': 'Från',
             'time_end': 'Till',
             }
         self.replace_int = {0: '', 1: '\u2713', 2: '?'}
-        self.db = Database()
+        self.db = Database() if db is None else db
         self.vote_symbol = '#'
+        self.cache = RenderCache() if cache is None else cache
+        self.metrics = metrics
+        self.events = events
+        self.formatter = Formatter() if formatter is None else formatter
 
     def new_context(self) -> None:
         self.booking_id = str(uuid.uuid1())
@@ -121,50 +654,71 @@ class BookingManager():
         update_items = {'title': title, 'description': description, 'location': location}
         selection = {'booking_id': self.booking_id}
         self.db.update_bookings(update_items, selection)
+        self.cache.invalidate(self.booking_id)
 
     def add_occasion(self, date: str, time_start: str, time_end: str) -> None:
-        occasion = self.db.get_occasion(self.booking_id)
-        new_occasion = DataFrame(
-            {k: [v] for k, v in zip(self.db.occasioncolumns, [self.booking_id, occasion, date, time_start, time_end])}
-            )
-        self.db.add(new_occasion)
+        self.add_occasions([date], [time_start], [time_end])
 
     def add_occasions(self, dates: List[str], start_times: List[str], end_times: List[str]) -> None:
-        for occasion in zip(dates, start_times, end_times):
-            self.add_occasion(occasion[0], occasion[1], occasion[2])
+        self.db.insert_occasions(self.booking_id, list(zip(dates, start_times, end_times)))
+        self.cache.invalidate(self.booking_id)
 
     def add_answer(self, occasion: int, name: str, answer: int) -> None:
-        new_answer = DataFrame(
-            {k: [v] for k, v in zip(self.db.answercolumns, [self.booking_id, occasion, name, answer])}
-            )
-        self.db.add(new_answer)
+        self.add_answers([occasion], name, [answer])
 
     def add_answers(self, occasions: List[int], name: str, answers: List[int]) -> None:
-        for occasion, answer in zip(occasions, answers):
-            self.add_answer(occasion, name, answer)
+        self.db.insert_answers(self.booking_id, name, list(zip(occasions, answers)))
+        self.cache.invalidate(self.booking_id)
+        self.publish(lambda: self.answers_event(name))
 
     def update_answer(self, occasion: int, name: str, answer: int) -> None:
-        update_items = {'answer': answer}
-        selection = {'occasion': occasion, 'name': name, 'booking_id': self.booking_id}
-        self.db.update_answers(update_items, selection)
+        self.update_answers([occasion], name, [answer])
 
     def update_answers(self, occasions: List[int], name: str, answers: List[int]) -> None:
-        for occasion, answer in zip(occasions, answers):
-            self.update_answer(occasion, name, answer)
+        self.db.upsert_answers(self.booking_id, name, list(zip(occasions, answers)))
+        self.cache.invalidate(self.booking_id)
+        self.publish(lambda: self.answers_event(name))
 
     def add_comment(self, name: str, comment: str) -> None:
         time_created = datetime.utcnow().replace(microsecond=0).isoformat()
-        new_comment = DataFrame(
-            {k: [v] for k, v in zip(self.db.commentcolumns, [self.booking_id, time_created, name, comment])}
-            )
-        self.db.add(new_comment)
+        self.db.add([CommentRow(self.booking_id, time_created, name, comment)])
+        self.cache.invalidate(self.booking_id)
+        self.publish(lambda: {
+            'type': 'comment',
+            'version': self.db.get_version(self.booking_id),
+            'name': name,
+            'time_created': self.formatter.local_time(time_created),
+            'comment': comment,
+            })
+
+    def publish(self, build: Callable[[], dict]) -> None:
+        # Events are only built when a stream of the booking is open
+        if self.events is not None:
+            self.events.publish(self.booking_id, build)
+
+    def answers_event(self, name: str) -> dict:
+        # The answers of a name with the votes and ranks of every occasion, all as they are now
+        version = self.db.get_version(self.booking_id)
+        occasions = self.occasions_list()
+        votes, ranks = self.vote_ranks(self.db.get_tallies(self.booking_id), occasions)
+        n_names = self.db.count_names(self.booking_id)
+        answers = self.db.get_name_answers(self.booking_id, name)
+        return {
+            'type': 'answers',
+            'version': version,
+            'name': name,
+            'cells': {str(x.occasion): self.replace_int.get(x.answer, x.answer) for x in answers},
+            'occasions': occasions,
+            'votes': ['' if n_yes is None else f'{n_yes}/{n_names}' for n_yes in votes],
+            'ranks': ranks,
+            }
 
     def is_active(self, booking_id: str = '') -> bool:
         if booking_id == '':
             booking_id = self.booking_id
-        result = self.db.get_active(booking_id).get('is_active')
+        result = self.db.get_active(booking_id)
         if len(result) > 0:
-            is_active = result[0]
+            is_active = result[0].is_active
         else:
             is_active = True
         return is_active
@@ -173,43 +727,65 @@ class BookingManager():
         update_items = {'is_active': is_active}
         selection = {'booking_id': self.booking_id}
         self.db.update_active(update_items, selection)
+        self.cache.invalidate(self.booking_id)
 
     def set_active(self, set_inactive: List[str]) -> None:
         booking_is_active = not (len(set_inactive) == 1 and set_inactive[0] != 'False')
         self.update_active(booking_is_active)
 
-    def to_local_time(self, time: str) -> str:
-        from_zone = tz.gettz('UTC')
-        to_zone = tz.gettz('Europe/Stockholm')
-        utc = datetime.strptime(time, '%Y-%m-%dT%H:%M:%S').replace(tzinfo=from_zone)
-        local = utc.astimezone(to_zone).replace(microsecond=0).strftime('%Y-%m-%d %H:%M')
-        return local
-
-    def weekday(self, date: str) -> str:
-        weekdays = [
-            "Måndag",
-            "Tisdag",
-            "Onsdag",
-            "Torsdag",
-            "Fredag",
-            "Lördag",
-            "Söndag"
-            ]
-        if date != '':
-            i = datetime.strptime(date, '%Y-%m-%d').weekday()
-            weekday = weekdays[i]
-        else:
-            weekday = ''
-        return weekday
+    def answer_grid(self, answers: List[AnswerRow], occasions: List[int], names: List[str]) -> List[list]:
+        # One pass over the answers gives the first answer per cell
+        cells = {}
+        for row in answers:
+            cells.setdefault((row.occasion, row.name), row.answer)
+        return [[cells.get((occasion, name), 0) for name in names] for occasion in occasions]
+
+    def vote_ranks(self, tallies: List[TallyRow], occasions: List[int]) -> Tuple[list, list]:
+        # Yes-votes and dense ranks of every answered occasion, read off the stored tallies
+        checked = {x.occasion: x.yes for x in tallies if x.no + x.yes + x.maybe > 0}
+        rank = {n_yes: i + 1 for i, n_yes in enumerate(sorted(set(checked.values()), reverse=True))}
+        votes = [checked.get(occasion) for occasion in occasions]
+        ranks = [rank[checked[occasion]] if occasion in checked else 0 for occasion in occasions]
+        return votes, ranks
+
+    def sorted_occasions(self) -> List[OccasionRow]:
+        return sorted(self.db.get_occasions(self.booking_id), key=lambda x: (x.date, x.time_start))
+
+    def phase(self, phase: str):
+        # Time a block when instrumented, otherwise a shared no-op
+        return NO_PHASE if self.metrics is None else self.metrics.phase(phase)
+
+    def to_table(self, edit_name: str = '', version: Optional[int] = None) -> dict:
+        # The version of the booking is read unless the caller already has it, a cached table of another
+        # version is rebuilt. Serve a copy so callers can add keys without touching the cached table.
+        if version is None:
+            version = self.db.get_version(self.booking_id)
+        table = self.cache.get(self.booking_id, edit_name, version)
+        if table is None:
+            table = self.build_table(edit_name)
+            self.cache.put(self.booking_id, edit_name, table, table['version'])
+        return dict(table)
+
+    def build_table(self, edit_name: str = '') -> dict:
+        # Read the versions before the data, so the table is never older than the versions it carries
+        booking = self.db.get_booking(self.booking_id)
+        comments = self.db.get_comments(self.booking_id)
+        answers = self.db.get_answers(self.booking_id)
+        occasions = self.sorted_occasions()
+        tallies = self.db.get_tallies(self.booking_id)
+        is_active = self.is_active()
 
-    def to_table(self, edit_name: str = '') -> dict:
+        with self.phase('build'):
+            return self.format_table(booking, comments, answers, occasions, tallies, is_active, edit_name)
+
+    def format_table(
+            self, booking: dict, comments: List[CommentRow], answers: List[AnswerRow], occasions: List[OccasionRow],
+            tallies: List[TallyRow], is_active: bool, edit_name: str = '',
+            ) -> dict:
         # Format booking comments
-        comments = self.db.get_comments(self.booking_id).sort_values(by=['time_created'])
-        comments = list(zip(
-            list(comments['name']),
-            [self.to_local_time(x) for x in list(comments['time_created'])],
-            list(comments['comment']),
-            ))
+        comments = sorted(comments, key=lambda x: x.time_created)
+        local_times = self.formatter.local_times([x.time_created for x in comments])
+        comments = [(x.name, local, x.comment) for x, local in zip(comments, local_times)]
 
         # Construct booking table header
         occasion_columns = ['date', 'time_start', 'time_end']
@@ -218,109 +794,203 @@ class BookingManager():
         show_header.extend([self.columns_translation[x] for x in occasion_columns])
         show_header.append(self.vote_symbol)
 
-        answers = self.db.get_answers(self.booking_id)
-        names = list(answers['name'].unique())
+        names = list(dict.fromkeys(x.name for x in answers))
         for name in names:
             if name != edit_name:
                 show_header.append(name)
 
-        answer_header = [v for i, v in enumerate(show_header) if i != show_header.index(self.vote_symbol)]
+        vote_index = show_header.index(self.vote_symbol)
+        answer_header = [v for i, v in enumerate(show_header) if i != vote_index]
 
-        # Calculate the most suitable occasions
-        answers_copy = answers.copy()
-        answers_copy['answer'] = answers_copy['answer'].apply(lambda x: int(x == 1))
-        answers_sum = answers_copy.groupby(by=['occasion']).sum()
-        best_occasions = DataFrame({
-            'occasion': list(answers_sum.index),
-            'checked': list(answers_sum['answer'])
-            })
-        best_occasions['rank'] = list(best_occasions.rank(method='dense', ascending=False)['checked'].astype(int))
+        # Flag the header columns holding names, so templates need not search the names
+        show_flags = [i > vote_index for i in range(len(show_header))]
+        answer_flags = [v for i, v in enumerate(show_flags) if i != vote_index]
+
+        # Pivot answers into an occasion by name grid, with votes and ranks from the tallies
+        occasion_ids = [x.occasion for x in occasions]
+        grid = self.answer_grid(answers, occasion_ids, names)
+        votes, ranks = self.vote_ranks(tallies, occasion_ids)
 
         # Construct booking table rows
         show_rows = []
         answer_rows = []
         edit_answers = []
-        ranks = []
-
-        occasions = self.db.get_occasions(self.booking_id).sort_values(by=['date', 'time_start'])
-        for occasion in occasions.iterrows():
-            occasion = occasion[1].to_dict()
-            row = [occasion[x] for x in occasion_columns]
-            occasion_vote = best_occasions[best_occasions['occasion'] == occasion['occasion']]
-            if len(occasion_vote) > 0:
-                n_yes = occasion_vote['checked'].iloc[0]
-                rank = occasion_vote['rank'].iloc[0]
-                row.append(f'{str(n_yes)}/{str(len(names))}')
-            else:
-                row.append('')
-                rank = 0
-            ranks.append(rank)
 
-            occasion_loc = (answers['occasion'] == occasion['occasion'])
+        weekdays = self.formatter.weekdays([x.date for x in occasions])
+        for occasion, cells, n_yes, weekday in zip(occasions, grid, votes, weekdays):
+            row = [getattr(occasion, x) for x in occasion_columns]
+            row.append('' if n_yes is None else f'{str(n_yes)}/{str(len(names))}')
 
-            for name in names:
-                name_loc = (answers['name'] == name)
-                answer = answers.loc[occasion_loc & name_loc, ['answer']]
-                if len(answer):
-                    answer = answer.iloc[0, 0]
-                else:
-                    answer = 0
+            for name, answer in zip(names, cells):
                 if name == edit_name:
                     edit_answers.append(answer)
                 else:
-                    row.extend([answer])
+                    row.append(answer)
 
             row = [self.replace_int.get(x, x) for x in row]
-            row.insert(0, self.weekday(row[0]))
+            row.insert(0, weekday)
 
             show_rows.append(row)
-            answer_rows.append([v for i, v in enumerate(row) if i != show_header.index(self.vote_symbol)])
+            answer_rows.append([v for i, v in enumerate(row) if i != vote_index])
 
         # Construct the input to booking HTML rendering
-        booking = self.db.get_booking(self.booking_id)
-
         table = {
             'booking_id': booking['booking_id'],
             'title': booking['title'],
-            'time_created': self.to_local_time(booking['time_created']),
+            'time_created': self.formatter.local_time(booking['time_created']),
             'location': booking['location'],
             'description': booking['description'],
             'header': {'show': show_header, 'answer': answer_header},
+            'name_columns': {'show': show_flags, 'answer': answer_flags},
             'rows': {'show': show_rows, 'answer': answer_rows},
+            'occasions': occasion_ids,
             'names': names,
             'edit_name': edit_name,
             'edit_answers': edit_answers,
             'ranks': ranks,
             'comments': comments,
-            'is_active': self.is_active()
+            'is_active': is_active,
+            'version': booking['version'],
+            'table_version': booking['table_version'],
             }
 
         return table
 
-    def index_list(self, n: int = 10) -> List[dict]:
-        bookings_raw = self.db.get_bookings().sort_values(by='time_created', ascending=False).iterrows()
-        bookings_list = []
-        i = 1
-        for booking in bookings_raw:
-            if i > n:
-                break
-            booking = booking[1].to_dict()
-            if not self.is_active(booking['booking_id']):
+    def details(self) -> dict:
+        booking = self.db.get_booking(self.booking_id)
+        return {
+            'booking_id': booking['booking_id'],
+            'title': booking['title'],
+            'time_created': self.formatter.local_time(booking['time_created']),
+            'location': booking['location'],
+            'description': booking['description'],
+            'is_active': self.is_active(),
+            'version': booking['version'],
+            }
+
+    def occasions_summary(self) -> List[dict]:
+        occasions = self.sorted_occasions()
+        tallies = {x.occasion: x for x in self.db.get_tallies(self.booking_id)}
+        votes, ranks = self.vote_ranks(list(tallies.values()), [x.occasion for x in occasions])
+        return [
+            {
+                'occasion': occasion.occasion,
+                'weekday': self.formatter.weekday(occasion.date),
+                'date': occasion.date,
+                'time_start': occasion.time_start,
+                'time_end': occasion.time_end,
+                'tally': dict(zip(TALLY_COLUMNS, tallies[occasion.occasion][2:])) if n_yes is not None else None,
+                'rank': rank,
+                }
+            for occasion, n_yes, rank in zip(occasions, votes, ranks)
+            ]
+
+    def answers_matrix(self) -> dict:
+        # One string of answer digits per name, a character per occasion in table order
+        occasions = self.occasions_list()
+        answers = self.db.get_answers(self.booking_id)
+        names = list(dict.fromkeys(x.name for x in answers))
+        grid = self.answer_grid(answers, occasions, names)
+        return {
+            'occasions': occasions,
+            'names': names,
+            'answers': [''.join(str(row[i]) for row in grid) for i in range(len(names))],
+            }
+
+    def comments_list(self) -> List[dict]:
+        comments = sorted(self.db.get_comments(self.booking_id), key=lambda x: x.time_created)
+        local_times = self.formatter.local_times([x.time_created for x in comments])
+        return [
+            {'name': x.name, 'time_created': local, 'comment': x.comment}
+            for x, local in zip(comments, local_times)
+            ]
+
+    def export_csv(self) -> Iterator[str]:
+        # CSV of every answer in chunks, of the booking or with booking columns of all active bookings
+        columns = ['date', 'time_start', 'time_end', 'name', 'answer']
+        if self.booking_id == '':
+            columns = ['booking_id', 'title'] + columns
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for i, row in enumerate(self.db.stream_answers(self.booking_id), 1):
+            writer.writerow([*row[-len(columns):-1], TALLY_COLUMNS[row[-1]]])
+            if i % STREAM_BATCH_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    def export_ics(self, top: int = 1) -> Iterator[str]:
+        # iCalendar events of the occasions in the top ranks, occasions without a date are left out
+        booking = self.db.get_booking(self.booking_id)
+        stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+        yield self.ics_lines(['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//book//book//SV', 'METHOD:PUBLISH'])
+        for occasion, date, time_start, time_end, n_yes in self.db.stream_top_occasions(self.booking_id, top):
+            try:
+                start, end = self.ics_times(date, time_start, time_end)
+            except ValueError:
                 continue
-            bookings_list.append({
-                'booking_id': booking['booking_id'],
-                'title': booking['title'],
-                'time_created': self.to_local_time(booking['time_created']),
-                'description': booking['description'],
-                })
-            i += 1
+            yield self.ics_lines([
+                'BEGIN:VEVENT',
+                f'UID:{self.booking_id}-{occasion}',
+                f'DTSTAMP:{stamp}',
+                'DTSTART' + start,
+                *(['DTEND' + end] if end else []),
+                'SUMMARY:' + self.ics_text(booking['title']),
+                'LOCATION:' + self.ics_text(booking['location'] or ''),
+                'DESCRIPTION:' + self.ics_text(booking['description'] or ''),
+                'END:VEVENT',
+                ])
+        yield self.ics_lines(['END:VCALENDAR'])
+
+    def ics_times(self, date: str, time_start: str, time_end: str) -> Tuple[str, str]:
+        # Start and end values in UTC, or a whole day when the occasion has no start time
+        day = datetime.strptime(date, '%Y-%m-%d')
+        if not time_start:
+            return ';VALUE=DATE:' + day.strftime('%Y%m%d'), ''
+        zone = self.formatter.zone
+        start = datetime.combine(day, datetime.strptime(time_start, '%H:%M').time(), zone)
+        values = [start]
+        if time_end:
+            end = datetime.combine(day, datetime.strptime(time_end, '%H:%M').time(), zone)
+            # An end before the start is on the next day
+            values.append(end if end > start else end + timedelta(days=1))
+        values = [':' + x.astimezone(tz.UTC).strftime('%Y%m%dT%H%M%SZ') for x in values]
+        return values[0], values[1] if len(values) > 1 else ''
+
+    def ics_text(self, text: str) -> str:
+        # Backslashes, separators and line breaks are escaped in iCalendar text values
+        for old, new in [('\\', '\\\\'), (';', '\\;'), (',', '\\,'), ('\r\n', '\\n'), ('\n', '\\n')]:
+            text = text.replace(old, new)
+        return text
+
+    def ics_lines(self, lines: List[str]) -> str:
+        # Content lines folded at 75 octets, without splitting a character, and ended by CRLF
+        folded = []
+        for line in lines:
+            data = line.encode()
+            while len(data) > 75:
+                cut = 75
+                while data[cut] & 0xC0 == 0x80:
+                    cut -= 1
+                folded.append(data[:cut].decode())
+                data = b' ' + data[cut:]
+            folded.append(data.decode())
+        return ''.join(x + '\r\n' for x in folded)
+
+    def index_list(self, n: int = 10, offset: int = 0, before: str = '') -> List[dict]:
+        bookings_list = self.db.get_index(n, offset, before)
+        local_times = self.formatter.local_times([x['time_created'] for x in bookings_list])
+        for booking, local in zip(bookings_list, local_times):
+            booking['time_created'] = local
         return bookings_list
 
     def occasions_list(self) -> List[int]:
-        return list(self.db.get_occasions(self.booking_id).sort_values(by=['date', 'time_start']).occasion)
+        return [x.occasion for x in self.sorted_occasions()]
 
     def names_list(self) -> List[str]:
-        return list(self.db.get_answers(self.booking_id).name)
+        return [x.name for x in self.db.get_answers(self.booking_id)]
 
     def prohibited_names(self) -> List[str]:
         return [c[1] for c in self.columns_translation.items()] + [self.vote_symbol]
@@ -0,0 +1,99 @@
+import os
+import pickle
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+# Tables kept in the shared cache file, the oldest stored are evicted first
+SHARED_CACHE_SIZE = 2048
+
+
+class SharedCache():
+    # Tables shared by the worker processes of one host through a SQLite file, a drop-in for RenderCache.
+    # Like there, entries are only served while the booking is still at the version they were built at.
+    def __init__(self, path: str, maxsize: int = SHARED_CACHE_SIZE):
+        self.path = path
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.pid = None
+        self.pool = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        with self.connection() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS tables ('
+                'booking_id TEXT NOT NULL, edit_name TEXT NOT NULL, version INTEGER NOT NULL, data BLOB NOT NULL, '
+                'PRIMARY KEY (booking_id, edit_name))'
+                )
+
+    def connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        # Losing the latest entries in a crash only costs rebuilding them
+        connection.execute('PRAGMA synchronous=OFF')
+        return connection
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        # Connections are pooled per process rather than kept per thread, as under gevent every request is a
+        # greenlet of its own. Workers forked from a process that used the cache start a pool of their own.
+        with self.lock:
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.pool = queue.LifoQueue()
+            pool = self.pool
+        try:
+            connection = pool.get_nowait()
+        except queue.Empty:
+            connection = self.connect()
+        try:
+            yield connection
+        finally:
+            pool.put(connection)
+
+    def get(self, booking_id: str, edit_name: str, version: int) -> Optional[dict]:
+        with self.connection() as connection:
+            row = connection.execute(
+                'SELECT data FROM tables WHERE booking_id = ? AND edit_name = ? AND version = ?',
+                (booking_id, edit_name, version),
+                ).fetchone()
+        with self.lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return pickle.loads(row[0])
+
+    def put(self, booking_id: str, edit_name: str, table: dict, version: int) -> None:
+        with self.connection() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO tables (booking_id, edit_name, version, data) VALUES (?, ?, ?, ?)',
+                (booking_id, edit_name, version, pickle.dumps(table, pickle.HIGHEST_PROTOCOL)),
+                )
+            # Replaced rows get a new rowid, so the smallest rowids were stored longest ago
+            evicted = connection.execute(
+                'DELETE FROM tables WHERE rowid <= (SELECT rowid FROM tables ORDER BY rowid DESC LIMIT 1 OFFSET ?)',
+                (self.maxsize,),
+                ).rowcount
+        with self.lock:
+            self.evictions += evicted
+
+    def invalidate(self, booking_id: str) -> None:
+        # Stale entries are never served, deleting them only frees their space
+        with self.connection() as connection:
+            connection.execute('DELETE FROM tables WHERE booking_id = ?', (booking_id,))
+
+    def info(self) -> dict:
+        with self.connection() as connection:
+            [size] = connection.execute('SELECT COUNT(*) FROM tables').fetchone()
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': size,
+                'maxsize': self.maxsize,
+                }
@@ -0,0 +1,78 @@
+import queue
+import threading
+from typing import Callable, Optional
+
+# Events a slow subscriber may fall behind by before it is told to reload instead
+MAX_QUEUED_EVENTS = 100
+
+
+class Subscription():
+    def __init__(self, booking_id: str, max_queued: int = MAX_QUEUED_EVENTS):
+        self.booking_id = booking_id
+        self.events = queue.Queue(max_queued)
+        self.overflowed = False
+
+    def get(self, timeout: float) -> Optional[dict]:
+        # The next event, or None when there was none within the timeout
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def clear(self) -> None:
+        # Drop the events held, which a reload of the page has overtaken
+        self.overflowed = False
+        while True:
+            try:
+                self.events.get_nowait()
+            except queue.Empty:
+                return
+
+
+class EventHub():
+    # Fans events of a booking out to the streams subscribed to it in this process. Only queues and
+    # locks are shared between threads, so it works the same under threads and gevent greenlets.
+    def __init__(self, max_queued: int = MAX_QUEUED_EVENTS):
+        self.max_queued = max_queued
+        self.subscriptions = {}
+        self.lock = threading.Lock()
+        self.publish_locks = {}
+
+    def subscribe(self, booking_id: str) -> Subscription:
+        subscription = Subscription(booking_id, self.max_queued)
+        with self.lock:
+            self.subscriptions.setdefault(booking_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self.lock:
+            subscriptions = self.subscriptions.get(subscription.booking_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self.subscriptions.pop(subscription.booking_id, None)
+                self.publish_locks.pop(subscription.booking_id, None)
+
+    def publish(self, booking_id: str, build: Callable[[], dict]) -> int:
+        # Build the event only when someone listens. Building and sending one event at a time per booking
+        # delivers events in the order their state was read, so the latest event carries the latest state.
+        with self.lock:
+            if booking_id not in self.subscriptions:
+                return 0
+            publish_lock = self.publish_locks.setdefault(booking_id, threading.Lock())
+        with publish_lock:
+            event = build()
+            with self.lock:
+                subscriptions = list(self.subscriptions.get(booking_id, ()))
+            for subscription in subscriptions:
+                try:
+                    subscription.events.put_nowait(event)
+                except queue.Full:
+                    subscription.overflowed = True
+            return len(subscriptions)
+
+    def info(self) -> dict:
+        with self.lock:
+            return {
+                'bookings': len(self.subscriptions),
+                'subscribers': sum(len(x) for x in self.subscriptions.values()),
+                }
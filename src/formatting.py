@@ -0,0 +1,69 @@
+from datetime import datetime, tzinfo
+from functools import lru_cache
+from dateutil import tz
+from typing import Iterable, List
+
+DEFAULT_TIMEZONE = 'Europe/Stockholm'
+
+WEEKDAYS = ('Måndag', 'Tisdag', 'Onsdag', 'Torsdag', 'Fredag', 'Lördag', 'Söndag')
+
+# Distinct timestamps and dates remembered per formatter
+FORMAT_CACHE_SIZE = 4096
+
+
+def get_zone(name: str) -> tzinfo:
+    # The standard library zones convert several times faster than dateutil's, which remain for Python 3.8
+    try:
+        from zoneinfo import ZoneInfo
+        return ZoneInfo(name)
+    except (ImportError, ValueError, KeyError):
+        zone = tz.gettz(name)
+    if zone is None:
+        raise ValueError(f'unknown timezone {name!r}')
+    return zone
+
+
+class Formatter():
+    # Display formatting in one timezone of the stored UTC timestamps and occasion dates, shared between requests
+    def __init__(self, timezone: str = DEFAULT_TIMEZONE, cache_size: int = FORMAT_CACHE_SIZE):
+        self.timezone = timezone
+        self.zone = get_zone(timezone)
+        self.cached_minute = lru_cache(cache_size)(self.convert_minute)
+        self.weekday = lru_cache(cache_size)(self.find_weekday)
+
+    def convert_minute(self, minute: str) -> str:
+        utc = datetime.fromisoformat(minute).replace(tzinfo=tz.UTC)
+        return utc.astimezone(self.zone).strftime('%Y-%m-%d %H:%M')
+
+    def local_time(self, time: str) -> str:
+        # Zones change offset on whole minutes, so timestamps within a minute share a conversion
+        return self.cached_minute(time[:16])
+
+    def local_times(self, times: List[str]) -> List[str]:
+        # A whole column in one pass, converting each distinct minute once
+        converted = {}
+        local = []
+        for time in times:
+            minute = time[:16]
+            if minute not in converted:
+                converted[minute] = self.cached_minute(minute)
+            local.append(converted[minute])
+        return local
+
+    def find_weekday(self, date: str) -> str:
+        if date == '':
+            return ''
+        return WEEKDAYS[datetime.strptime(date, '%Y-%m-%d').weekday()]
+
+    def weekdays(self, dates: Iterable[str]) -> List[str]:
+        return [self.weekday(x) for x in dates]
+
+    def info(self) -> dict:
+        times = self.cached_minute.cache_info()
+        dates = self.weekday.cache_info()
+        return {
+            'timezone': self.timezone,
+            'hits': times.hits + dates.hits,
+            'misses': times.misses + dates.misses,
+            'size': times.currsize + dates.currsize,
+            }
@@ -0,0 +1,187 @@
+import csv
+import json
+import time
+import uuid
+from datetime import datetime
+from src.book import Database, BookingManager, TALLY_COLUMNS
+from src.models import BookingRow, ActiveRow, OccasionRow, AnswerRow, CommentRow
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Optional
+
+# Columns a CSV file needs, as written by the exports
+CSV_COLUMNS = ('date', 'time_start', 'time_end', 'name', 'answer')
+
+
+class Importer():
+    # Loads polls read from files as whole bookings, in one transaction per batch of rows
+    def __init__(self, db: Database, batch_size: int = 20000):
+        self.db = db
+        self.batch_size = batch_size
+        self.prohibited_names = set(BookingManager(db=db).prohibited_names())
+
+    def read_jsonl(self, lines: Iterable[str]) -> Iterator[dict]:
+        # One poll per line, with occasions, answers as {name: [answer per occasion]} and comments.
+        # Polls carry their line number, a line that cannot be read is passed on with its error to be reported.
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                poll = json.loads(line)
+                if not isinstance(poll, dict):
+                    raise ValueError('a poll must be a JSON object')
+                occasions = [
+                    (x.get('date', ''), x.get('time_start', ''), x.get('time_end', ''))
+                    for x in poll.get('occasions', [])
+                    ]
+                answers = [
+                    (i, name, answer)
+                    for name, values in poll.get('answers', {}).items() for i, answer in enumerate(values)
+                    ]
+                comments = [
+                    (x.get('time_created', ''), x.get('name', ''), x.get('comment', ''))
+                    for x in poll.get('comments', [])
+                    ]
+            except (ValueError, TypeError, AttributeError) as error:
+                yield {'line': number, 'error': str(error)}
+                continue
+            yield {
+                **poll, 'line': number, 'error': None, 'occasions': occasions, 'answers': answers, 'comments': comments,
+                }
+
+    def read_csv(self, lines: Iterable[str], title: str = '') -> Iterator[dict]:
+        # One row per answer as written by the exports, rows of a booking must follow each other,
+        # without a booking_id column the whole file is one poll. A poll with a malformed row is passed
+        # on with its error to be reported.
+        reader = csv.DictReader(lines)
+        missing = [x for x in CSV_COLUMNS if x not in (reader.fieldnames or [])]
+        if missing:
+            yield {'line': 1, 'error': f"missing columns {', '.join(missing)}"}
+            return
+        poll = None
+        for row in reader:
+            booking_id = row.get('booking_id', '')
+            if poll is None or poll['booking_id'] != booking_id:
+                if poll is not None:
+                    yield self.csv_poll(poll)
+                poll = {
+                    'booking_id': booking_id, 'title': row.get('title', title), 'line': reader.line_num, 'error': None,
+                    'occasions': {}, 'answers': [],
+                    }
+            # Short rows have None for the missing fields and long rows their extra fields under None
+            if None in row or None in row.values():
+                error = f'line {reader.line_num} does not have the {len(reader.fieldnames)} fields of the header'
+                poll['error'] = poll['error'] or error
+                continue
+            key = (row['date'], row['time_start'], row['time_end'])
+            occasion = poll['occasions'].setdefault(key, len(poll['occasions']))
+            poll['answers'].append((occasion, row['name'], row['answer']))
+        if poll is not None:
+            yield self.csv_poll(poll)
+
+    def csv_poll(self, poll: dict) -> dict:
+        return {**poll, 'occasions': list(poll['occasions'])}
+
+    def answer_value(self, answer) -> int:
+        if isinstance(answer, str) and answer in TALLY_COLUMNS:
+            return TALLY_COLUMNS.index(answer)
+        value = int(answer)
+        if value not in range(len(TALLY_COLUMNS)):
+            raise ValueError(f'unknown answer {answer!r}')
+        return value
+
+    def to_rows(self, poll: dict) -> List[NamedTuple]:
+        # Validated rows of one poll, a ValueError describes what is wrong with it
+        if poll.get('error'):
+            raise ValueError(poll['error'])
+        booking_id = poll.get('booking_id') or str(uuid.uuid1())
+        title = poll.get('title', '')
+        if not title:
+            raise ValueError('title is required')
+        time_created = poll.get('time_created') or datetime.utcnow().replace(microsecond=0).isoformat()
+        datetime.strptime(time_created, '%Y-%m-%dT%H:%M:%S')
+        occasions = poll['occasions']
+        # Anything else would only fail when the batch is written
+        texts = [booking_id, title, poll.get('description', ''), poll.get('location', '')]
+        texts.extend(x for occasion in occasions for x in occasion)
+        texts.extend(x[1] for x in poll['answers'])
+        texts.extend(x for comment in poll.get('comments', []) for x in comment)
+        if not all(isinstance(x, str) for x in texts):
+            raise ValueError('titles, occasions, names and comments must be text')
+        rows = [
+            BookingRow(
+                booking_id, len(occasions), title, time_created, poll.get('description', ''), poll.get('location', ''),
+                1, 1,
+                ),
+            ]
+        if not poll.get('is_active', True):
+            rows.append(ActiveRow(booking_id, False))
+        rows.extend(OccasionRow(booking_id, i, *occasion) for i, occasion in enumerate(occasions))
+        answered = set()
+        for occasion, name, answer in poll['answers']:
+            if not name:
+                raise ValueError('name is required')
+            if name in self.prohibited_names:
+                raise ValueError(f'name "{name}" is not allowed')
+            if occasion >= len(occasions):
+                raise ValueError(f'{name} has more answers than there are occasions')
+            if (occasion, name) in answered:
+                raise ValueError(f'{name} answers occasion {occasions[occasion]} twice')
+            answered.add((occasion, name))
+            rows.append(AnswerRow(booking_id, occasion, name, self.answer_value(answer)))
+        for comment_time, name, comment in poll.get('comments', []):
+            comment_time = comment_time or time_created
+            datetime.strptime(comment_time, '%Y-%m-%dT%H:%M:%S')
+            if not name or not comment:
+                raise ValueError('comments need a name and a comment')
+            rows.append(CommentRow(booking_id, comment_time, name, comment))
+        return rows
+
+    def poll_name(self, poll: dict, i: int) -> str:
+        # How a skipped poll is reported, by booking id and the line it starts on when known
+        booking_id = poll.get('booking_id') if isinstance(poll.get('booking_id'), str) else ''
+        where = f"line {poll['line']}" if 'line' in poll else f'poll {i + 1}'
+        return f'{booking_id} ({where})' if booking_id else where
+
+    def load(self, polls: Iterable[dict], progress: Optional[Callable[[dict], None]] = None) -> dict:
+        # Validate and insert polls, skipping invalid ones and those whose booking_id is taken
+        stats = {'bookings': 0, 'rows': 0, 'skipped': [], 'seconds': 0.0}
+        start = time.perf_counter()
+        batch = []
+        seen = set()
+
+        def flush():
+            existing = self.db.existing_bookings([x[0].booking_id for x in batch])
+            rows = []
+            for poll_rows in batch:
+                if poll_rows[0].booking_id in existing:
+                    stats['skipped'].append((poll_rows[0].booking_id, 'booking already exists'))
+                else:
+                    rows.extend(poll_rows)
+                    stats['bookings'] += 1
+            self.db.load(rows)
+            stats['rows'] += len(rows)
+            stats['seconds'] = time.perf_counter() - start
+            batch.clear()
+            if progress is not None:
+                progress(stats)
+
+        n_rows = 0
+        for i, poll in enumerate(polls):
+            try:
+                poll_rows = self.to_rows(poll)
+            except (ValueError, TypeError, KeyError) as error:
+                stats['skipped'].append((self.poll_name(poll, i), str(error)))
+                continue
+            booking_id = poll_rows[0].booking_id
+            if booking_id in seen:
+                stats['skipped'].append((booking_id, 'booking appears twice'))
+                continue
+            seen.add(booking_id)
+            batch.append(poll_rows)
+            n_rows += len(poll_rows)
+            if n_rows >= self.batch_size:
+                flush()
+                n_rows = 0
+        if batch:
+            flush()
+        stats['seconds'] = time.perf_counter() - start
+        return stats
@@ -0,0 +1,149 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Upper bounds in seconds of the request duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Context manager of phases when there is no request to record them in
+NO_PHASE = nullcontext()
+
+
+class RequestTimings():
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.phases = {}
+        self.render_depth = 0
+        self.render_start = 0.0
+
+    def add_phase(self, phase: str, seconds: float) -> None:
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def server_timing(self, seconds: float) -> str:
+        # Server-Timing header value, durations in milliseconds
+        metrics = [f'db;desc="{self.queries} queries";dur={self.sql_seconds * 1000:.2f}']
+        metrics.extend(f'{phase};dur={x * 1000:.2f}' for phase, x in self.phases.items())
+        metrics.append(f'total;dur={seconds * 1000:.2f}')
+        return ', '.join(metrics)
+
+
+class Metrics():
+    # Opt-in per-request timings, totalled per endpoint for /metrics, nothing is recorded outside of a request
+    def __init__(self):
+        self.current = contextvars.ContextVar('request_timings', default=None)
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.durations = {}
+        self.queries = {}
+        self.sql_seconds = {}
+        self.phase_seconds = {}
+
+    def instrument_engine(self, engine: Engine) -> None:
+        # Count and time every statement run on the engine within a request
+        @event.listens_for(engine, 'before_cursor_execute')
+        def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+            if self.current.get() is not None:
+                connection.info.setdefault('query_start', []).append(time.perf_counter())
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+            timings = self.current.get()
+            if timings is not None and connection.info.get('query_start'):
+                timings.queries += 1
+                timings.sql_seconds += time.perf_counter() - connection.info['query_start'].pop()
+
+    def start_request(self) -> contextvars.Token:
+        return self.current.set(RequestTimings())
+
+    def finish_request(self, token: contextvars.Token, endpoint: str, status: int) -> Tuple[RequestTimings, float]:
+        timings = self.current.get()
+        self.current.reset(token)
+        seconds = time.perf_counter() - timings.start
+        with self.lock:
+            key = (endpoint, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            buckets, total = self.durations.get(endpoint, ([0] * len(DURATION_BUCKETS), 0.0))
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    buckets[i] += 1
+            self.durations[endpoint] = (buckets, total + seconds)
+            self.queries[endpoint] = self.queries.get(endpoint, 0) + timings.queries
+            self.sql_seconds[endpoint] = self.sql_seconds.get(endpoint, 0.0) + timings.sql_seconds
+            for phase, x in timings.phases.items():
+                self.phase_seconds[(endpoint, phase)] = self.phase_seconds.get((endpoint, phase), 0.0) + x
+        return timings, seconds
+
+    @contextmanager
+    def timed(self, phase: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            timings = self.current.get()
+            if timings is not None:
+                timings.add_phase(phase, time.perf_counter() - start)
+
+    def phase(self, phase: str):
+        # Time a block of the current request, a shared no-op outside of requests
+        if self.current.get() is None:
+            return NO_PHASE
+        return self.timed(phase)
+
+    def start_render(self) -> None:
+        # Templates rendered within templates, such as fragments, count once as part of the outermost
+        timings = self.current.get()
+        if timings is not None:
+            if timings.render_depth == 0:
+                timings.render_start = time.perf_counter()
+            timings.render_depth += 1
+
+    def end_render(self) -> None:
+        timings = self.current.get()
+        if timings is not None and timings.render_depth > 0:
+            timings.render_depth -= 1
+            if timings.render_depth == 0:
+                timings.add_phase('render', time.perf_counter() - timings.render_start)
+
+    def prometheus(self, gauges: Optional[Dict[str, Tuple[str, float]]] = None) -> str:
+        # Totals in the Prometheus text exposition format, with extra gauges as {name: (help, value)}
+        lines = []
+
+        def family(name: str, kind: str, help_text: str, samples: List[Tuple[str, float]]) -> None:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.extend(f'{name}{labels} {value}' for labels, value in samples)
+
+        with self.lock:
+            family('book_requests_total', 'counter', 'Requests handled by endpoint and status.', [
+                (f'{{endpoint="{endpoint}",status="{status}"}}', n)
+                for (endpoint, status), n in sorted(self.requests.items())
+                ])
+            samples = []
+            for endpoint, (buckets, total) in sorted(self.durations.items()):
+                count = sum(n for (x, _), n in self.requests.items() if x == endpoint)
+                samples.extend(
+                    (f'_bucket{{endpoint="{endpoint}",le="{bound}"}}', n) for bound, n in zip(DURATION_BUCKETS, buckets)
+                    )
+                samples.append((f'_bucket{{endpoint="{endpoint}",le="+Inf"}}', count))
+                samples.append((f'_sum{{endpoint="{endpoint}"}}', round(total, 6)))
+                samples.append((f'_count{{endpoint="{endpoint}"}}', count))
+            family('book_request_duration_seconds', 'histogram', 'Request duration by endpoint.', samples)
+            family('book_db_queries_total', 'counter', 'SQL statements run by endpoint.', [
+                (f'{{endpoint="{endpoint}"}}', n) for endpoint, n in sorted(self.queries.items())
+                ])
+            family('book_db_seconds_total', 'counter', 'Time spent in SQL statements by endpoint.', [
+                (f'{{endpoint="{endpoint}"}}', round(x, 6)) for endpoint, x in sorted(self.sql_seconds.items())
+                ])
+            family('book_phase_seconds_total', 'counter', 'Time spent building tables and rendering by endpoint.', [
+                (f'{{endpoint="{endpoint}",phase="{phase}"}}', round(x, 6))
+                for (endpoint, phase), x in sorted(self.phase_seconds.items())
+                ])
+        for name, (help_text, value) in (gauges or {}).items():
+            family(name, 'gauge', help_text, [('', value)])
+        return '\n'.join(lines) + '\n'
@@ -1,5 +1,5 @@
-from typing import Optional, List
-from sqlalchemy import ForeignKey
+from typing import Optional, List, NamedTuple
+from sqlalchemy import ForeignKey, ForeignKeyConstraint, Index
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 
@@ -9,17 +9,21 @@ class Base(DeclarativeBase):
 
 class Booking(Base):
     __tablename__ = "bookings"
+    __table_args__ = (Index("ix_bookings_time_created", "time_created"),)
     booking_id: Mapped[str] = mapped_column(primary_key=True)
     time_created: Mapped[str] = mapped_column()
     next_occasion: Mapped[int] = mapped_column()
     title: Mapped[str] = mapped_column()
     description: Mapped[Optional[str]] = mapped_column()
     location: Mapped[Optional[str]] = mapped_column()
+    version: Mapped[int] = mapped_column(default=0, server_default="0")
+    table_version: Mapped[int] = mapped_column(default=0, server_default="0")
     occasions: Mapped[List["Occasion"]] = relationship()
 
 
 class Active(Base):
     __tablename__ = "active"
+    __table_args__ = (Index("uq_active_booking_id", "booking_id", unique=True),)
     active_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     booking_id: Mapped[str] = mapped_column(ForeignKey("bookings.booking_id"))
     is_active: Mapped[bool] = mapped_column(default=True)
@@ -27,6 +31,7 @@ class Active(Base):
 
 class Occasion(Base):
     __tablename__ = "occasions"
+    __table_args__ = (Index("uq_occasions_booking_id_occasion", "booking_id", "occasion", unique=True),)
     occasion_id: Mapped[int] = mapped_column(primary_key=True)
     booking_id: Mapped[str] = mapped_column(ForeignKey("bookings.booking_id"))
     occasion: Mapped[int] = mapped_column()
@@ -38,17 +43,89 @@ class Occasion(Base):
 
 class Answer(Base):
     __tablename__ = "answers"
+    __table_args__ = (
+        Index("uq_answers_booking_id_occasion_name", "booking_id", "occasion", "name", unique=True),
+        ForeignKeyConstraint(["booking_id", "occasion"], ["occasions.booking_id", "occasions.occasion"]),
+        )
     answer_id: Mapped[int] = mapped_column(primary_key=True)
     booking_id: Mapped[str] = mapped_column(ForeignKey("bookings.booking_id"))
     name: Mapped[str] = mapped_column()
-    occasion: Mapped[int] = mapped_column(ForeignKey("occasions.occasion"))
+    occasion: Mapped[int] = mapped_column()
     answer: Mapped[int] = mapped_column()
 
 
+class Tally(Base):
+    __tablename__ = "tallies"
+    __table_args__ = (
+        ForeignKeyConstraint(["booking_id", "occasion"], ["occasions.booking_id", "occasions.occasion"]),
+        )
+    booking_id: Mapped[str] = mapped_column(ForeignKey("bookings.booking_id"), primary_key=True)
+    occasion: Mapped[int] = mapped_column(primary_key=True)
+    no: Mapped[int] = mapped_column(default=0)
+    yes: Mapped[int] = mapped_column(default=0)
+    maybe: Mapped[int] = mapped_column(default=0)
+
+
 class Comment(Base):
     __tablename__ = "comments"
+    __table_args__ = (Index("ix_comments_booking_id_time_created", "booking_id", "time_created"),)
     comment_id: Mapped[int] = mapped_column(primary_key=True)
     booking_id: Mapped[str] = mapped_column(ForeignKey("bookings.booking_id"))
     time_created: Mapped[str] = mapped_column()
     name: Mapped[str] = mapped_column()
     comment: Mapped[str] = mapped_column()
+
+
+class Archive(Base):
+    # Archived bookings with all their rows, as zlib compressed JSON
+    __tablename__ = "archives"
+    booking_id: Mapped[str] = mapped_column(primary_key=True)
+    time_archived: Mapped[str] = mapped_column()
+    data: Mapped[bytes] = mapped_column()
+
+
+# Plain rows passed between the database and the booking manager
+class BookingRow(NamedTuple):
+    booking_id: str
+    next_occasion: int
+    title: str
+    time_created: str
+    description: Optional[str]
+    location: Optional[str]
+    version: int
+    table_version: int
+
+
+class OccasionRow(NamedTuple):
+    booking_id: str
+    occasion: int
+    date: Optional[str]
+    time_start: Optional[str]
+    time_end: Optional[str]
+
+
+class AnswerRow(NamedTuple):
+    booking_id: str
+    occasion: int
+    name: str
+    answer: int
+
+
+class TallyRow(NamedTuple):
+    booking_id: str
+    occasion: int
+    no: int
+    yes: int
+    maybe: int
+
+
+class CommentRow(NamedTuple):
+    booking_id: str
+    time_created: str
+    name: str
+    comment: str
+
+
+class ActiveRow(NamedTuple):
+    booking_id: str
+    is_active: bool
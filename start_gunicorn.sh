@@ -0,0 +1,6 @@
+#!/bin/bash
+
+# Production server, see gunicorn.conf.py for the BOOK_WORKERS, BOOK_WORKER_CLASS and BOOK_BIND settings
+export PASSWORD=${PASSWORD:?Set the login password in PASSWORD}
+
+gunicorn -c gunicorn.conf.py app:app
@@ -75,3 +75,117 @@ function tristate(control, value0, value1, value2) {
             alert(control.value);
     }
 }
+
+
+// Live results on the show page, patched in place from server-sent events
+const rankColors = {1: "#9ecae1", 2: "#c6dbef", 3: "#eff3ff"};
+
+function showTable() {
+    return document.querySelector("table.show[data-events]");
+}
+
+// fetches the page again and swaps in its table and comments
+function refreshResults() {
+    fetch(window.location.href, {cache: "no-cache"})
+        .then((response) => response.text())
+        .then((html) => {
+            let page = new DOMParser().parseFromString(html, "text/html");
+            let table = showTable();
+            let newTable = page.querySelector("table.show[data-events]");
+            if (newTable === null) {
+                return;
+            }
+            table.innerHTML = newTable.innerHTML;
+            table.dataset.version = newTable.dataset.version;
+            document.getElementById("comments").innerHTML = page.getElementById("comments").innerHTML;
+        });
+}
+
+// adds an empty column for a name answering for the first time
+function addNameColumn(table, name, editUrl) {
+    let label = document.createElement("th");
+    label.setAttribute("class", "rotate");
+    label.dataset.name = name;
+    let labelDiv = document.createElement("div");
+    let labelSpan = document.createElement("span");
+    labelSpan.textContent = name.length <= 12 ? name : name.slice(0, 9) + "...";
+    labelDiv.appendChild(labelSpan);
+    label.appendChild(labelDiv);
+    table.rows[0].appendChild(label);
+
+    let pen = document.createElement("th");
+    pen.setAttribute("class", "pen");
+    let link = document.createElement("a");
+    link.setAttribute("href", editUrl);
+    let penDiv = document.createElement("div");
+    penDiv.appendChild(document.createElement("span"));
+    penDiv.appendChild(document.createTextNode(" ✎ "));
+    link.appendChild(penDiv);
+    pen.appendChild(link);
+    table.rows[1].appendChild(pen);
+
+    for (let row of table.querySelectorAll("tr[data-occasion]")) {
+        row.appendChild(document.createElement("td"));
+    }
+}
+
+function patchAnswers(table, event) {
+    let rows = Array.from(table.querySelectorAll("tr[data-occasion]"));
+    let occasions = rows.map((row) => Number(row.dataset.occasion));
+    // Occasions added or removed meanwhile change the whole table
+    if (occasions.join() !== event.occasions.join()) {
+        refreshResults();
+        return;
+    }
+    let names = Array.from(table.rows[0].querySelectorAll("th[data-name]")).map((th) => th.dataset.name);
+    let column = names.indexOf(event.name);
+    if (column === -1) {
+        addNameColumn(table, event.name, table.dataset.answer + "/" + encodeURIComponent(event.name));
+        column = names.length;
+    }
+    // Weekday, date, start, end and votes come before the names
+    column += 5;
+    rows.forEach((row, i) => {
+        let occasion = event.occasions[i];
+        if (occasion in event.cells) {
+            row.cells[column].textContent = event.cells[occasion];
+        }
+        row.cells[4].textContent = event.votes[i];
+        row.style.backgroundColor = rankColors[event.ranks[i]] || "";
+    });
+}
+
+function appendComment(event) {
+    let comments = document.getElementById("comments");
+    let empty = comments.querySelector(".no-comments");
+    if (empty !== null) {
+        empty.remove();
+    }
+    let name = document.createElement("b");
+    name.textContent = event.name;
+    let paragraphs = [document.createElement("p"), document.createElement("p"), document.createElement("p")];
+    paragraphs[0].appendChild(name);
+    paragraphs[1].setAttribute("class", "timestamp");
+    paragraphs[1].textContent = event.time_created;
+    paragraphs[2].textContent = event.comment;
+    comments.appendChild(document.createElement("br"));
+    paragraphs.forEach((p) => comments.appendChild(p));
+    comments.appendChild(document.createElement("br"));
+}
+
+function followResults(table) {
+    let source = new EventSource(table.dataset.events + "?version=" + table.dataset.version);
+    source.addEventListener("answers", (message) => {
+        patchAnswers(table, JSON.parse(message.data));
+        table.dataset.version = message.lastEventId;
+    });
+    source.addEventListener("comment", (message) => {
+        appendComment(JSON.parse(message.data));
+        table.dataset.version = message.lastEventId;
+    });
+    source.addEventListener("stale", refreshResults);
+}
+
+if (showTable() !== null && window.EventSource !== undefined) {
+    followResults(showTable());
+}
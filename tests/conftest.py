@@ -0,0 +1,84 @@
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+
+import pytest
+
+from src.book import Database, RenderCache
+from src.events import EventHub
+from src.models import Base
+
+
+@pytest.fixture(scope='session')
+def postgres_url():
+    # A PostgreSQL server given in BOOK_TEST_POSTGRES_URL, whose tables are dropped and recreated,
+    # or a throwaway one launched with initdb/pg_ctl listening on a Unix socket in a temporary directory
+    url = os.getenv('BOOK_TEST_POSTGRES_URL')
+    if url:
+        yield url
+        return
+    bin_dir = os.getenv('PG_BIN', '')
+    initdb = shutil.which('initdb', path=bin_dir or None)
+    pg_ctl = shutil.which('pg_ctl', path=bin_dir or None)
+    if initdb is None or pg_ctl is None:
+        pytest.skip('initdb and pg_ctl not found, set PG_BIN or BOOK_TEST_POSTGRES_URL')
+    pytest.importorskip('psycopg2')
+    directory = tempfile.mkdtemp()
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        port = s.getsockname()[1]
+    # initdb refuses to run as root, for example
+    if subprocess.run([initdb, '-D', directory, '-A', 'trust', '-U', 'book'], capture_output=True).returncode != 0:
+        shutil.rmtree(directory, ignore_errors=True)
+        pytest.skip('could not launch a local PostgreSQL server, set BOOK_TEST_POSTGRES_URL')
+    options = f"-p {port} -k {directory} -c listen_addresses=''"
+    subprocess.run([pg_ctl, '-D', directory, '-o', options, '-w', 'start'], check=True, capture_output=True)
+    try:
+        yield f'postgresql+psycopg2://book@/postgres?host={directory}&port={port}'
+    finally:
+        subprocess.run([pg_ctl, '-D', directory, '-m', 'fast', 'stop'], capture_output=True)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+@pytest.fixture(params=['sqlite', 'sqlite-without-returning', 'postgresql'])
+def db(request, tmp_path):
+    if request.param == 'postgresql':
+        url = request.getfixturevalue('postgres_url')
+        stale = Database(url)
+        Base.metadata.drop_all(stale.engine)
+        stale.engine.dispose()
+    else:
+        url = f'sqlite+pysqlite:///{tmp_path / "tables.db"}'
+    db = Database(url)
+    if request.param == 'sqlite-without-returning':
+        # As on SQLite before 3.35, which has no RETURNING
+        db.engine.dialect.update_returning = False
+        db.engine.dialect.delete_returning = False
+    yield db
+    db.engine.dispose()
+
+
+@pytest.fixture
+def app(db: Database, monkeypatch, tmp_path):
+    # The app served from the test database, with caches of its own
+    monkeypatch.setenv('PASSWORD', 'test')
+    if 'app' not in sys.modules:
+        monkeypatch.setenv('BOOK_DATABASE_URL', db.engine.url.render_as_string(hide_password=False))
+        monkeypatch.setenv('BOOK_SECRET_KEY_FILE', str(tmp_path / 'secret_key'))
+    import app
+    monkeypatch.setattr(app, 'db', db)
+    monkeypatch.setattr(app, 'cache', RenderCache())
+    monkeypatch.setattr(app, 'fragments', RenderCache(app.app.config['FRAGMENT_CACHE_SIZE']))
+    monkeypatch.setattr(app, 'hub', EventHub())
+    return app
+
+
+@pytest.fixture
+def client(app):
+    # A logged in test client
+    client = app.app.test_client()
+    client.post('/login', data={'password': 'test'})
+    return client
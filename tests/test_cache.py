@@ -0,0 +1,47 @@
+import threading
+
+from src.book import RenderCache
+from src.cache import SharedCache
+
+
+def test_render_cache_versions() -> None:
+    cache = RenderCache(2)
+    cache.put('b1', '', {'version': 1}, 1)
+    assert cache.get('b1', '', 1) == {'version': 1}
+    assert cache.get('b1', '', 2) is None
+    cache.put('b2', '', {}, 1)
+    cache.put('b3', '', {}, 1)
+    assert cache.get('b1', '', 1) is None
+    assert cache.info()['size'] == 2
+
+
+def test_shared_cache(tmp_path) -> None:
+    cache = SharedCache(str(tmp_path / 'cache.db'), maxsize=2)
+    cache.put('b1', '', {'version': 1}, 1)
+    # Another process sees the entry, but only at its version
+    other = SharedCache(str(tmp_path / 'cache.db'), maxsize=2)
+    assert other.get('b1', '', 1) == {'version': 1}
+    assert other.get('b1', '', 2) is None
+    cache.put('b2', '', {}, 1)
+    cache.put('b1', 'anna', {}, 1)
+    assert other.get('b1', '', 1) is None
+    assert cache.info()['size'] == 2 and cache.info()['evictions'] == 1
+    cache.invalidate('b1')
+    assert cache.info()['size'] == 1
+
+
+def test_shared_cache_connections(tmp_path) -> None:
+    # Requests in threads or greenlets of their own reuse the connections of the process
+    cache = SharedCache(str(tmp_path / 'cache.db'))
+    connect = cache.connect
+    opened = []
+    cache.connect = lambda: opened.append(1) or connect()
+    for i in range(20):
+        thread = threading.Thread(target=cache.put, args=(f'b{i}', '', {}, 1))
+        thread.start()
+        thread.join()
+    assert opened == []
+    # A forked worker opens its own
+    cache.pid = None
+    assert cache.get('b1', '', 1) == {}
+    assert opened == [1]
@@ -0,0 +1,52 @@
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+N_BOOKINGS = 8
+N_THREADS = 16
+N_ROUNDS = 10
+
+
+def worker(app, titles: dict, thread: int) -> list:
+    # Answers polls of its own choosing, checking that each page belongs to the poll asked for
+    rng = random.Random(thread)
+    client = app.test_client()
+    client.post('/login', data={'password': os.environ['PASSWORD']})
+    errors = []
+    for i in range(N_ROUNDS):
+        booking_id = rng.choice(list(titles))
+        page = client.get(f'/show/{booking_id}').get_data(as_text=True)
+        if titles[booking_id] not in page:
+            errors.append(f'/show/{booking_id} rendered another booking')
+        name = f'{booking_id[:8]}-{thread}-{i}'
+        page = client.get(f'/answer/{booking_id}').get_data(as_text=True)
+        n_occasions = page.count('name="tristate_answers"')
+        client.post(f'/answer/{booking_id}', data={
+            'name': name,
+            'comment': name,
+            'tristate_answers': ['✅'] * n_occasions,
+            })
+    return errors
+
+
+def test_concurrent_answers(app) -> None:
+    titles = {}
+    for i in range(N_BOOKINGS):
+        b = app.manager()
+        b.new_context()
+        b.update_bookings(f'Booking number {i:03d}', '', '')
+        b.set_active([])
+        b.add_occasions(['2023-06-01', '2023-06-02'], ['18:00', '18:00'], ['20:00', '20:00'])
+        titles[b.booking_id] = f'Booking number {i:03d}'
+
+    with ThreadPoolExecutor(N_THREADS) as executor:
+        errors = sum(executor.map(lambda x: worker(app.app, titles, x), range(N_THREADS)), [])
+    assert errors == []
+
+    # Every answer sits in the poll its author posted to, next to its comment
+    for booking_id in titles:
+        b = app.manager(booking_id)
+        assert all(x.startswith(booking_id[:8]) for x in b.names_list())
+        table = b.to_table()
+        assert len(table['comments']) == len(table['names'])
+    assert sum(len(set(app.manager(x).names_list())) for x in titles) == N_THREADS * N_ROUNDS
@@ -0,0 +1,211 @@
+import json
+
+import pytest
+from sqlalchemy.exc import IntegrityError, NoResultFound
+
+from src.book import Database, BookingManager
+from src.importer import Importer
+from src.models import AnswerRow, OccasionRow
+
+
+def new_booking(db: Database, title: str = 'Title') -> BookingManager:
+    b = BookingManager(db=db)
+    b.new_context()
+    b.update_bookings(title, 'Description', 'Location')
+    b.set_active([])
+    return b
+
+
+def test_booking_details(db: Database) -> None:
+    b = new_booking(db)
+    b.update_bookings('New title', 'New description', '')
+    booking = db.get_booking(b.booking_id)
+    assert (booking['title'], booking['description'], booking['location']) == ('New title', 'New description', '')
+
+
+def test_occasion_numbers(db: Database) -> None:
+    b = new_booking(db)
+    b.add_occasions(['2023-06-02', '2023-06-01'], ['18:00', '18:00'], ['20:00', '20:00'])
+    b.add_occasion('2023-06-03', '', '')
+    assert sorted(b.occasions_list()) == [0, 1, 2]
+    assert b.occasions_list()[0] == 1
+    assert db.get_occasion(b.booking_id) == 3
+
+
+def test_answers(db: Database) -> None:
+    b = new_booking(db)
+    b.add_occasions(['2023-06-01', '2023-06-02', '2023-06-03'], [''] * 3, [''] * 3)
+    occasions = b.occasions_list()
+    b.add_answers(occasions[:2], 'anna', [1, 2])
+    b.update_answers(occasions, 'anna', [0, 1, 1])
+    b.add_answers(occasions, 'bo', [1, 1, 0])
+    table = b.to_table('anna')
+    assert table['names'] == ['anna', 'bo']
+    assert table['edit_answers'] == [0, 1, 1]
+    assert [row[4] for row in table['rows']['show']] == ['1/2', '2/2', '1/2']
+    assert table['ranks'] == [2, 1, 2]
+
+
+def test_tallies(db: Database) -> None:
+    b = new_booking(db)
+    b.add_occasions(['2023-06-01', '2023-06-02'], [''] * 2, [''] * 2)
+    occasions = b.occasions_list()
+    b.add_answers(occasions, 'anna', [1, 2])
+    b.add_answers(occasions[:1], 'bo', [0])
+    b.update_answers(occasions, 'bo', [1, 1])
+    db.update_answers({'answer': 2}, {'booking_id': b.booking_id, 'occasion': occasions[0], 'name': 'anna'})
+    assert [tuple(x[2:]) for x in db.get_tallies(b.booking_id)] == [(0, 1, 1), (0, 1, 1)]
+    assert db.check_tallies(b.booking_id) == []
+    db.rebuild_tallies(b.booking_id)
+    assert [tuple(x[2:]) for x in db.get_tallies(b.booking_id)] == [(0, 1, 1), (0, 1, 1)]
+
+
+def test_versions(db: Database) -> None:
+    b = new_booking(db)
+    version = db.get_version(b.booking_id)
+    writes = [
+        lambda: b.update_bookings('Title', '', ''),
+        lambda: b.set_active([]),
+        lambda: b.add_occasion('2023-06-01', '', ''),
+        lambda: b.add_answer(0, 'anna', 1),
+        lambda: b.update_answer(0, 'anna', 2),
+        lambda: b.add_comment('anna', 'Comment'),
+        ]
+    for write in writes:
+        write()
+        assert db.get_version(b.booking_id) > version
+        version = db.get_version(b.booking_id)
+    assert db.get_version('missing') is None
+
+
+def test_add_rows(db: Database) -> None:
+    # Occasions and answers added directly would leave the table version and the tallies behind
+    b = new_booking(db)
+    with pytest.raises(ValueError):
+        db.add([OccasionRow(b.booking_id, 0, '2023-06-01', '', '')])
+    with pytest.raises(ValueError):
+        db.add([AnswerRow(b.booking_id, 0, 'anna', 1)])
+    assert db.get_occasions(b.booking_id) == [] and db.get_answers(b.booking_id) == []
+
+
+def test_unique_answers(db: Database) -> None:
+    b = new_booking(db)
+    b.add_occasion('2023-06-01', '', '')
+    b.add_answer(0, 'anna', 1)
+    with pytest.raises(IntegrityError):
+        b.add_answer(0, 'anna', 2)
+    assert [x.answer for x in db.get_answers(b.booking_id)] == [1]
+
+
+def test_active(db: Database) -> None:
+    b = new_booking(db)
+    assert b.is_active()
+    b.set_active(['on'])
+    assert not b.is_active()
+    b.set_active([])
+    assert b.is_active()
+    assert len(db.get_active(b.booking_id)) == 1
+
+
+def test_comments(db: Database) -> None:
+    b = new_booking(db)
+    b.add_comment('anna', 'First')
+    b.add_comment('bo', 'Second')
+    assert [(x[0], x[2]) for x in b.to_table()['comments']] == [('anna', 'First'), ('bo', 'Second')]
+
+
+def test_index(db: Database) -> None:
+    booking_ids = [new_booking(db, f'Index {i}').booking_id for i in range(5)]
+    hidden = BookingManager(booking_ids[2], db)
+    hidden.set_active(['on'])
+    listed = [x['booking_id'] for x in BookingManager(db=db).index_list(100)]
+    assert booking_ids[2] not in listed
+    assert set(booking_ids) - set(listed) == {booking_ids[2]}
+    first = BookingManager(db=db).index_list(2)
+    rest = BookingManager(db=db).index_list(100, before=first[-1]['booking_id'])
+    assert [x['booking_id'] for x in first + rest] == listed
+    assert BookingManager(db=db).index_list(2, offset=2) == rest[:2]
+
+
+def test_export(db: Database) -> None:
+    b = new_booking(db)
+    b.add_occasions(['2023-06-02', '2023-06-01', '2023-06-03'], ['18:00', '18:00', ''], ['20:00', '20:00', ''])
+    occasions = b.occasions_list()
+    b.add_answers(occasions, 'anna', [1, 2, 1])
+    b.add_answers(occasions, 'bo', [0, 1, 1])
+    lines = ''.join(b.export_csv()).splitlines()
+    assert lines[0] == 'date,time_start,time_end,name,answer'
+    assert lines[1:3] == ['2023-06-01,18:00,20:00,anna,yes', '2023-06-01,18:00,20:00,bo,no']
+    assert len(lines) == 7
+    hidden = new_booking(db)
+    hidden.add_occasion('2023-06-01', '', '')
+    hidden.add_answer(0, 'anna', 1)
+    hidden.set_active(['on'])
+    exported = {x.split(',')[0] for x in ''.join(BookingManager(db=db).export_csv()).splitlines()}
+    assert b.booking_id in exported and hidden.booking_id not in exported
+    events = ''.join(b.export_ics()).split('BEGIN:VEVENT')[1:]
+    assert [x.split('DTSTART')[1].split('\r\n')[0] for x in events] == [';VALUE=DATE:20230603']
+    events = ''.join(b.export_ics(top=2)).split('BEGIN:VEVENT')[1:]
+    assert [x.split('DTSTART')[1].split('\r\n')[0] for x in events][:2] == [':20230601T160000Z', ':20230602T160000Z']
+    assert len(events) == 3
+
+
+def test_import(db: Database) -> None:
+    b = new_booking(db)
+    b.add_occasions(['2023-06-01', '2023-06-02'], ['18:00', ''], ['20:00', ''])
+    b.add_answers(b.occasions_list(), 'anna', [1, 2])
+    b.add_answers(b.occasions_list(), 'bo', [0, 1])
+    exported = ''.join(b.export_csv()).splitlines(keepends=True)
+    before = {x.booking_id for x in db.get_bookings()}
+    importer = Importer(db)
+    stats = importer.load(importer.read_csv(exported, title='Imported'))
+    assert stats['bookings'] == 1 and not stats['skipped']
+    [imported] = {x.booking_id for x in db.get_bookings()} - before
+    assert ''.join(BookingManager(imported, db).export_csv()).splitlines(keepends=True) == exported
+    assert db.check_tallies(imported) == []
+    again = json.dumps({'booking_id': imported, 'title': 'Again', 'occasions': []})
+    stats = importer.load(importer.read_jsonl([again]))
+    assert stats['skipped'] == [(imported, 'booking already exists')]
+    # Unreadable lines are reported by line number and the polls after them still load
+    lines = ['{"title": "Broken', '[1, 2]', '{"title": ["x"]}', json.dumps({'title': 'Valid', 'occasions': []})]
+    stats = importer.load(importer.read_jsonl(lines))
+    assert stats['bookings'] == 1 and [x[0] for x in stats['skipped']] == ['line 1', 'line 2', 'line 3']
+    stats = importer.load(importer.read_csv(['date,name,answer\n', '2023-06-01,anna,yes\n'], title='Missing'))
+    assert stats['bookings'] == 0 and stats['skipped'] == [('line 1', 'missing columns time_start, time_end')]
+
+
+def test_archive(db: Database) -> None:
+    b = new_booking(db)
+    b.add_occasions(['2023-06-01', '2023-06-02'], ['18:00', ''], ['20:00', ''])
+    b.add_answers(b.occasions_list(), 'anna', [1, 2])
+    b.add_answers(b.occasions_list(), 'bo', [0, 1])
+    b.add_comment('anna', 'Comment')
+    b.set_active(['on'])
+    table = b.build_table()
+    version = db.get_version(b.booking_id)
+    assert b.booking_id in db.archive_candidates()
+    assert db.archive([b.booking_id]) == 1
+    assert db.get_version(b.booking_id) is None and db.get_answers(b.booking_id) == []
+    assert b.booking_id not in db.archive_candidates()
+    # A write that lost the race with archiving fails instead of leaving rows without a booking
+    with pytest.raises((IntegrityError, NoResultFound)):
+        db.insert_answers(b.booking_id, 'late', [(0, 1)])
+    assert db.get_answers(b.booking_id) == [] and db.get_tallies(b.booking_id) == []
+    assert db.restore(b.booking_id) and not db.restore(b.booking_id)
+    assert db.get_version(b.booking_id) == version
+    assert b.build_table() == table
+    assert db.check_tallies(b.booking_id) == []
+    assert db.archive_candidates(inactive=False, created_before='0000') == []
+    db.compact()
+
+
+def test_import_archived_id(db: Database) -> None:
+    b = new_booking(db)
+    b.set_active(['on'])
+    assert db.archive([b.booking_id]) == 1
+    poll = json.dumps({'booking_id': b.booking_id, 'title': 'Imported', 'occasions': []})
+    stats = Importer(db).load(Importer(db).read_jsonl([poll]))
+    assert stats['bookings'] == 0 and stats['skipped'] == [(b.booking_id, 'booking already exists')]
+    assert db.get_version(b.booking_id) is None
+    assert db.restore(b.booking_id)
+    assert db.get_booking(b.booking_id)['title'] == 'Title'
@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+from src.events import EventHub
+
+
+@pytest.fixture
+def booking_id(app) -> str:
+    b = app.manager()
+    b.new_context()
+    b.update_bookings('Title', '', '')
+    b.set_active([])
+    b.add_occasions(['2023-06-01'], ['18:00'], ['20:00'])
+    return b.booking_id
+
+
+def answer(client, booking_id: str, name: str) -> None:
+    client.post(f'/answer/{booking_id}', data={'name': name, 'comment': '', 'tristate_answers': ['✅']})
+
+
+def events(chunks) -> list:
+    # The (id, event, data) of each server-sent event, keepalives and the retry line left out
+    for chunk in chunks:
+        fields = dict(x.split(': ', 1) for x in chunk.strip().split('\n') if not x.startswith((':', 'retry')))
+        if fields:
+            yield int(fields['id']), fields['event'], json.loads(fields['data'])
+
+
+def follow(app, client, booking_id: str, monkeypatch):
+    # A stream that has subscribed and read the current version, waiting for events
+    monkeypatch.setitem(app.app.config, 'EVENTS_KEEPALIVE', 0.01)
+    response = client.get(f'/events/{booking_id}?version={app.db.get_version(booking_id)}', buffered=False)
+    chunks = (x.decode() for x in response.response)
+    assert next(chunks).startswith('retry: ')
+    assert next(chunks) == ': keepalive\n\n'
+    return response, chunks
+
+
+def test_answer_event(app, client, booking_id: str, monkeypatch) -> None:
+    response, chunks = follow(app, client, booking_id, monkeypatch)
+    assert response.mimetype == 'text/event-stream'
+    answer(client, booking_id, 'anna')
+    event_id, event, data = next(events(chunks))
+    assert (event_id, event, data['name']) == (app.db.get_version(booking_id), 'answers', 'anna')
+    assert app.hub.info() == {'bookings': 1, 'subscribers': 1}
+    response.close()
+    assert app.hub.info() == {'bookings': 0, 'subscribers': 0}
+
+
+def test_missed_changes(app, client, booking_id: str) -> None:
+    # A stream reconnecting after changes it did not carry is told to reload
+    version = app.db.get_version(booking_id)
+    answer(client, booking_id, 'anna')
+    for request in [{'headers': {'Last-Event-ID': str(version)}}, {'query_string': {'version': version}}]:
+        response = client.get(f'/events/{booking_id}', buffered=False, **request)
+        assert next(events(x.decode() for x in response.response)) == (app.db.get_version(booking_id), 'stale', {})
+        response.close()
+
+
+def test_overflow(app, client, booking_id: str, monkeypatch) -> None:
+    # A stream that fell behind is told to reload at the current version, dropping the events it holds
+    monkeypatch.setattr(app, 'hub', EventHub(max_queued=1))
+    response, chunks = follow(app, client, booking_id, monkeypatch)
+    answer(client, booking_id, 'anna')
+    answer(client, booking_id, 'bo')
+    stream = events(chunks)
+    assert next(stream) == (app.db.get_version(booking_id), 'stale', {})
+    answer(client, booking_id, 'cecilia')
+    event_id, event, data = next(stream)
+    assert (event_id, event, data['name']) == (app.db.get_version(booking_id), 'answers', 'cecilia')
+    response.close()
+
+
+def test_unknown_booking(client) -> None:
+    assert client.get('/events/missing').status_code == 404
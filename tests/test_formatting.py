@@ -0,0 +1,59 @@
+import sys
+
+import pytest
+from dateutil import tz
+
+from src.formatting import Formatter, get_zone
+
+# UTC timestamps around the Stockholm clock changes of 2023 and the local times they show
+DST_TIMES = [
+    ('2023-03-26T00:59:59', '2023-03-26 01:59'),
+    ('2023-03-26T01:00:00', '2023-03-26 03:00'),
+    ('2023-10-29T00:59:00', '2023-10-29 02:59'),
+    ('2023-10-29T01:00:00', '2023-10-29 02:00'),
+    ('2023-06-01T12:30:45', '2023-06-01 14:30'),
+    ('2023-12-31T23:30:00', '2024-01-01 00:30'),
+    ]
+
+
+@pytest.fixture(params=['zoneinfo', 'dateutil'])
+def formatter(request, monkeypatch) -> Formatter:
+    if request.param == 'dateutil':
+        # As on Python 3.8, without zoneinfo
+        monkeypatch.setitem(sys.modules, 'zoneinfo', None)
+    return Formatter('Europe/Stockholm')
+
+
+def test_local_time(formatter: Formatter) -> None:
+    for time, local in DST_TIMES:
+        assert formatter.local_time(time) == local
+    assert formatter.local_times([x[0] for x in DST_TIMES] * 2) == [x[1] for x in DST_TIMES] * 2
+
+
+def test_zone_fallback(monkeypatch) -> None:
+    assert type(get_zone('Europe/Stockholm')).__module__ == 'zoneinfo'
+    monkeypatch.setitem(sys.modules, 'zoneinfo', None)
+    assert isinstance(get_zone('Europe/Stockholm'), tz.tzfile)
+
+
+@pytest.mark.parametrize('fallback', [False, True])
+def test_unknown_zone(fallback: bool, monkeypatch) -> None:
+    if fallback:
+        monkeypatch.setitem(sys.modules, 'zoneinfo', None)
+    with pytest.raises(ValueError):
+        Formatter('Europe/Nowhere')
+
+
+def test_minute_cache() -> None:
+    # Timestamps within a minute share one conversion
+    formatter = Formatter('UTC')
+    assert formatter.local_times(['2023-06-01T10:00:01', '2023-06-01T10:00:59', '2023-06-01T10:01:00']) == [
+        '2023-06-01 10:00', '2023-06-01 10:00', '2023-06-01 10:01',
+        ]
+    assert formatter.info()['misses'] == 2
+
+
+def test_weekdays() -> None:
+    formatter = Formatter()
+    assert formatter.weekdays(['2023-06-01', '2023-06-04', '', '2023-06-01']) == ['Torsdag', 'Söndag', '', 'Torsdag']
+    assert formatter.weekday('2023-06-05') == 'Måndag'
@@ -0,0 +1,115 @@
+import json
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+from src.metrics import DURATION_BUCKETS, Metrics
+
+# Run in a process of its own, as the hooks are installed when the app is imported
+APP_SCRIPT = '''
+import json
+import app
+client = app.app.test_client()
+client.post('/login', data={'password': 'test'})
+b = app.manager()
+b.new_context()
+b.update_bookings('Title', '', '')
+b.set_active([])
+b.add_occasions(['2023-06-01'], ['18:00'], ['20:00'])
+show = client.get(f'/show/{b.booking_id}')
+metrics = client.get('/metrics')
+print(json.dumps({
+    'server_timing': show.headers.get('Server-Timing'),
+    'metrics_status': metrics.status_code,
+    'metrics': metrics.get_data(as_text=True),
+    'hooks': [
+        x.__name__
+        for hooks in [app.app.before_request_funcs, app.app.after_request_funcs, app.app.teardown_request_funcs]
+        for x in hooks.get(None, [])
+        ],
+    'listeners': len(app.db.engine.dispatch.before_cursor_execute),
+    }))
+'''
+
+SAMPLE = re.compile(r'^(\w+)(\{.*\})? (\S+)$')
+
+
+def run_app(tmp_path, enabled: bool) -> dict:
+    env = {
+        **os.environ,
+        'PASSWORD': 'test',
+        'BOOK_METRICS': 'true' if enabled else 'false',
+        'BOOK_DATABASE_URL': f'sqlite+pysqlite:///{tmp_path / "tables.db"}',
+        'BOOK_SECRET_KEY_FILE': str(tmp_path / 'secret_key'),
+        }
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, '-c', APP_SCRIPT], cwd=root, env=env, capture_output=True, text=True, check=True
+        )
+    return json.loads(result.stdout)
+
+
+def parse(text: str) -> dict:
+    # Samples of the Prometheus text format by name and labels, checking that every line is well formed
+    samples = {}
+    for line in text.splitlines():
+        if line.startswith('# '):
+            assert re.match(r'^# (HELP \w+ .+|TYPE \w+ (counter|gauge|histogram))$', line)
+            continue
+        name, labels, value = SAMPLE.match(line).groups()
+        samples[(name, labels or '')] = float(value)
+    return samples
+
+
+def test_metrics_enabled(tmp_path) -> None:
+    result = run_app(tmp_path, True)
+    assert re.match(r'^db;desc="\d+ queries";dur=[\d.]+, .*total;dur=[\d.]+$', result['server_timing'])
+    assert result['metrics_status'] == 200
+    samples = parse(result['metrics'])
+    assert samples[('book_requests_total', '{endpoint="show",status="200"}')] == 1
+    buckets = [samples[('book_request_duration_seconds_bucket', f'{{endpoint="show",le="{x}"}}')]
+               for x in DURATION_BUCKETS + ('+Inf',)]
+    assert buckets == sorted(buckets) and buckets[-1] == 1
+    assert samples[('book_request_duration_seconds_count', '{endpoint="show"}')] == 1
+    assert samples[('book_db_queries_total', '{endpoint="show"}')] > 0
+    assert ('book_table_cache_misses', '') in samples and ('book_event_streams', '') in samples
+    assert {'start_timing', 'add_server_timing', 'finish_failed_timing'} <= set(result['hooks'])
+
+
+def test_metrics_disabled(tmp_path) -> None:
+    result = run_app(tmp_path, False)
+    assert result['server_timing'] is None and result['metrics_status'] == 404
+    assert not {'start_timing', 'add_server_timing', 'finish_failed_timing'} & set(result['hooks'])
+    assert result['listeners'] == 0
+
+
+def test_request_timings() -> None:
+    metrics = Metrics()
+    with metrics.phase('build'):
+        pass
+    assert metrics.requests == {} and metrics.phase_seconds == {}
+    token = metrics.start_request()
+    with metrics.phase('build'):
+        pass
+    metrics.start_render()
+    metrics.start_render()
+    metrics.end_render()
+    metrics.end_render()
+    timings, seconds = metrics.finish_request(token, 'show', 200)
+    assert list(timings.phases) == ['build', 'render']
+    assert timings.server_timing(seconds).startswith('db;desc="0 queries";dur=0.00, build;dur=')
+    assert metrics.current.get() is None
+
+
+@pytest.mark.parametrize('seconds', [0.001, 0.03, 10.0])
+def test_histogram_buckets(seconds: float, monkeypatch) -> None:
+    metrics = Metrics()
+    token = metrics.start_request()
+    start = metrics.current.get().start
+    monkeypatch.setattr('src.metrics.time.perf_counter', lambda: start + seconds)
+    metrics.finish_request(token, 'index', 200)
+    buckets, total = metrics.durations['index']
+    assert buckets == [int(seconds <= x) for x in DURATION_BUCKETS] and total == pytest.approx(seconds)
@@ -0,0 +1,92 @@
+import logging
+
+import pytest
+from sqlalchemy import create_engine, inspect
+
+from src.book import Database
+
+# The tables as created before versions, tallies, archives and the unique indexes existed
+BASELINE_SCHEMA = [
+    'CREATE TABLE bookings (booking_id VARCHAR NOT NULL, time_created VARCHAR NOT NULL, '
+    'next_occasion INTEGER NOT NULL, title VARCHAR NOT NULL, description VARCHAR, location VARCHAR, '
+    'PRIMARY KEY (booking_id))',
+    'CREATE TABLE active (active_id INTEGER NOT NULL, booking_id VARCHAR NOT NULL, is_active BOOLEAN NOT NULL, '
+    'PRIMARY KEY (active_id), FOREIGN KEY(booking_id) REFERENCES bookings (booking_id))',
+    'CREATE TABLE occasions (occasion_id INTEGER NOT NULL, booking_id VARCHAR NOT NULL, occasion INTEGER NOT NULL, '
+    'date VARCHAR, time_start VARCHAR, time_end VARCHAR, PRIMARY KEY (occasion_id), '
+    'FOREIGN KEY(booking_id) REFERENCES bookings (booking_id))',
+    'CREATE TABLE answers (answer_id INTEGER NOT NULL, booking_id VARCHAR NOT NULL, name VARCHAR NOT NULL, '
+    'occasion INTEGER NOT NULL, answer INTEGER NOT NULL, PRIMARY KEY (answer_id), '
+    'FOREIGN KEY(booking_id) REFERENCES bookings (booking_id), FOREIGN KEY(occasion) REFERENCES occasions (occasion))',
+    'CREATE TABLE comments (comment_id INTEGER NOT NULL, booking_id VARCHAR NOT NULL, time_created VARCHAR NOT NULL, '
+    'name VARCHAR NOT NULL, comment VARCHAR NOT NULL, PRIMARY KEY (comment_id), '
+    'FOREIGN KEY(booking_id) REFERENCES bookings (booking_id))',
+    ]
+
+BASELINE_ROWS = [
+    "INSERT INTO bookings VALUES ('b1', '2023-01-01T00:00:00', 2, 'Title', '', '')",
+    "INSERT INTO active VALUES (1, 'b1', 1)",
+    "INSERT INTO active VALUES (2, 'b1', 0)",
+    "INSERT INTO occasions VALUES (1, 'b1', 0, '2023-06-01', '', '')",
+    "INSERT INTO occasions VALUES (2, 'b1', 1, '2023-06-02', '', '')",
+    "INSERT INTO occasions VALUES (3, 'b1', 1, '2023-06-03', '', '')",
+    "INSERT INTO answers VALUES (1, 'b1', 'anna', 0, 1)",
+    "INSERT INTO answers VALUES (2, 'b1', 'anna', 1, 2)",
+    "INSERT INTO answers VALUES (3, 'b1', 'anna', 1, 0)",
+    "INSERT INTO answers VALUES (4, 'b1', 'bo', 1, 1)",
+    "INSERT INTO comments VALUES (1, 'b1', '2023-01-01T00:00:00', 'anna', 'Comment')",
+    ]
+
+
+@pytest.fixture
+def baseline_url(tmp_path) -> str:
+    url = f'sqlite+pysqlite:///{tmp_path / "tables.db"}'
+    engine = create_engine(url)
+    with engine.begin() as connection:
+        for statement in BASELINE_SCHEMA + BASELINE_ROWS:
+            connection.exec_driver_sql(statement)
+    engine.dispose()
+    return url
+
+
+def test_migrate_baseline(baseline_url: str, caplog) -> None:
+    with caplog.at_level(logging.WARNING, logger='src.book'):
+        db = Database(baseline_url)
+    assert sorted(x.getMessage() for x in caplog.records) == [
+        'Deleted 1 duplicate rows from active to create uq_active_booking_id',
+        'Deleted 1 duplicate rows from answers to create uq_answers_booking_id_occasion_name',
+        'Deleted 1 duplicate rows from occasions to create uq_occasions_booking_id_occasion',
+        ]
+
+    inspector = inspect(db.engine)
+    assert {'version', 'table_version'} <= {x['name'] for x in inspector.get_columns('bookings')}
+    assert {'tallies', 'archives'} <= set(inspector.get_table_names())
+    indexes = {
+        x['name']: x['unique'] for table in ['occasions', 'answers', 'active'] for x in inspector.get_indexes(table)
+        }
+    assert indexes == {
+        'uq_occasions_booking_id_occasion': 1,
+        'uq_answers_booking_id_occasion_name': 1,
+        'uq_active_booking_id': 1,
+        }
+
+    # The first row of each duplicate survives, and the tallies count what is left
+    assert [(x.occasion, x.date) for x in db.get_occasions('b1')] == [(0, '2023-06-01'), (1, '2023-06-02')]
+    assert sorted((x.name, x.occasion, x.answer) for x in db.get_answers('b1')) == [
+        ('anna', 0, 1), ('anna', 1, 2), ('bo', 1, 1),
+        ]
+    assert [x.is_active for x in db.get_active('b1')] == [True]
+    assert [tuple(x[1:]) for x in db.get_tallies('b1')] == [(0, 0, 1, 0), (1, 0, 1, 1)]
+    assert db.check_tallies() == []
+    version = db.get_version('b1')
+    db.engine.dispose()
+
+    # Running again changes nothing
+    caplog.clear()
+    with caplog.at_level(logging.WARNING, logger='src.book'):
+        db = Database(baseline_url)
+    assert caplog.records == []
+    assert db.migrate() == {}
+    assert db.get_version('b1') == version
+    assert len(db.get_answers('b1')) == 3
+    db.engine.dispose()
@@ -0,0 +1,111 @@
+import pytest
+
+
+@pytest.fixture
+def booking_id(app) -> str:
+    b = app.manager()
+    b.new_context()
+    b.update_bookings('Title', 'Description', 'Location')
+    b.set_active([])
+    b.add_occasions(['2023-06-01', '2023-06-02'], ['18:00', '18:00'], ['20:00', '20:00'])
+    return b.booking_id
+
+
+def answer(client, booking_id: str, name: str):
+    return client.post(f'/answer/{booking_id}', data={'name': name, 'comment': '', 'tristate_answers': ['✅', '❌']})
+
+
+@pytest.mark.parametrize('path', ['/show/{}', '/answer/{}', '/api/bookings/{}/occasions'])
+def test_etag(client, booking_id: str, path: str) -> None:
+    path = path.format(booking_id)
+    first = client.get(path)
+    assert first.status_code == 200 and first.headers['Cache-Control'] == 'private, no-cache'
+    etag = first.headers['ETag']
+    cached = client.get(path, headers={'If-None-Match': etag})
+    assert cached.status_code == 304 and cached.data == b'' and cached.headers['ETag'] == etag
+    assert answer(client, booking_id, 'anna').status_code == 302
+    changed = client.get(path, headers={'If-None-Match': etag})
+    assert changed.status_code == 200 and changed.headers['ETag'] != etag
+    assert client.get(path, headers={'If-None-Match': changed.headers['ETag']}).status_code == 304
+
+
+def test_etag_token(app, client, booking_id: str, monkeypatch) -> None:
+    # Pages rendered by another deploy are sent again
+    etag = client.get(f'/show/{booking_id}').headers['ETag']
+    monkeypatch.setattr(app, 'etag_token', 'redeploy')
+    response = client.get(f'/show/{booking_id}', headers={'If-None-Match': etag})
+    assert response.status_code == 200 and response.headers['ETag'] != etag
+
+
+def test_build_token(app, tmp_path) -> None:
+    (tmp_path / 'templates').mkdir()
+    (tmp_path / 'app.py').write_text('')
+    (tmp_path / 'templates' / 'show.html').write_text('old')
+    token = app.build_token(str(tmp_path), 'Europe/Stockholm')
+    assert app.build_token(str(tmp_path), 'Europe/Stockholm') == token
+    assert app.build_token(str(tmp_path), 'UTC') != token
+    (tmp_path / 'templates' / 'show.html').write_text('new')
+    assert app.build_token(str(tmp_path), 'Europe/Stockholm') != token
+
+
+def test_etag_flash(client, booking_id: str) -> None:
+    # A pending message is shown, even on a page the client holds
+    etag = client.get(f'/show/{booking_id}').headers['ETag']
+    with client.session_transaction() as session:
+        session['_flashes'] = [('message', 'Sparat.')]
+    response = client.get(f'/show/{booking_id}', headers={'If-None-Match': etag})
+    assert response.status_code == 200 and 'Sparat.' in response.get_data(as_text=True)
+    assert client.get(f'/show/{booking_id}', headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_missing_booking(client) -> None:
+    assert client.get('/show/missing').status_code == 404
+
+
+def test_read_secret_key(app, tmp_path) -> None:
+    path = tmp_path / 'keys' / 'secret_key'
+    path.parent.mkdir()
+    key = app.read_secret_key(str(path))
+    assert len(key) > 20 and app.read_secret_key(str(path)) == key
+    assert path.stat().st_mode & 0o777 == 0o600
+    assert [x.name for x in path.parent.iterdir()] == ['secret_key']
+
+
+def test_read_secret_key_without_links(app, tmp_path, monkeypatch) -> None:
+    def link(source, target):
+        raise PermissionError('hard links not supported')
+
+    monkeypatch.setattr(app.os, 'link', link)
+    path = tmp_path / 'keys' / 'secret_key'
+    path.parent.mkdir()
+    key = app.read_secret_key(str(path))
+    assert app.read_secret_key(str(path)) == key == path.read_text()
+    assert path.stat().st_mode & 0o777 == 0o600
+    assert [x.name for x in path.parent.iterdir()] == ['secret_key']
+
+
+def test_fragments(app, client, booking_id: str) -> None:
+    # Writes to occasions and answers rebuild the table fragments, comments only their own
+    def table_version() -> int:
+        return app.db.get_booking(booking_id)['table_version']
+
+    old = table_version()
+    client.get(f'/show/{booking_id}')
+    client.get(f'/answer/{booking_id}')
+    assert '1/1' not in app.fragments.get(booking_id, 'show_rows:', old)
+    assert '2023-06-03' not in app.fragments.get(booking_id, 'answer_table:', old)
+
+    answer(client, booking_id, 'anna')
+    app.manager(booking_id).add_occasion('2023-06-03', '', '')
+    assert table_version() > old
+    assert '1/1' in client.get(f'/show/{booking_id}').get_data(as_text=True)
+    assert '2023-06-03' in client.get(f'/answer/{booking_id}').get_data(as_text=True)
+    assert '1/1' in app.fragments.get(booking_id, 'show_rows:', table_version())
+    assert '2023-06-03' in app.fragments.get(booking_id, 'answer_table:', table_version())
+    assert app.fragments.get(booking_id, 'show_rows:', old) is None
+
+    old = table_version()
+    client.post(f'/comment/{booking_id}', data={'name': 'bo', 'comment': 'A new comment'})
+    misses = app.fragments.info()['misses']
+    assert 'A new comment' in client.get(f'/show/{booking_id}').get_data(as_text=True)
+    assert table_version() == old and app.fragments.info()['misses'] == misses + 1